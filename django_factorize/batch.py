@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import argparse
+import collections
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from django_factorize.contrib import color
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+BatchResult = collections.namedtuple(
+    'BatchResult',
+    ['settings', 'directory', 'ok', 'output', 'error', 'elapsed'])
+
+# Options forwarded as is to the factorize command
+_FACTORIZE_OPTIONS = ('report', 'write', 'fsync', 'force', 'build_factories',
+                      'costs', 'cost_threshold', 'cost_comments', 'verify',
+                      'dump_file', 'dump_depth', 'dump_items')
+
+
+def _run_factorize(task):
+    settings_module, directory, command_options = task
+    start = time.time()
+    output = StringIO()
+    stdout = sys.stdout
+    try:
+        # Local apps and written files are relative to the project directory
+        os.chdir(directory)
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+        # Keep stray prints from interleaving with other projects' output
+        sys.stdout = output
+        import django
+        if hasattr(django, 'setup'):
+            django.setup()
+        from django.core.management import call_command
+        call_command('factorize', stdout=output, **command_options)
+    except Exception:  # pylint: disable=broad-except
+        return BatchResult(settings=settings_module,
+                           directory=directory,
+                           ok=False,
+                           output=output.getvalue(),
+                           error=traceback.format_exc(),
+                           elapsed=time.time() - start)
+    finally:
+        sys.stdout = stdout
+    return BatchResult(settings=settings_module,
+                       directory=directory,
+                       ok=True,
+                       output=output.getvalue(),
+                       error=None,
+                       elapsed=time.time() - start)
+
+
+def _parse_project(project, pythonpath):
+    directory, _, settings_module = project.rpartition(':')
+    return settings_module, os.path.abspath(directory or pythonpath)
+
+
+def _get_pool(jobs):
+    # Fresh interpreters: the parent's Django state must not leak in
+    try:
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:
+        context = multiprocessing
+    return context.Pool(jobs, maxtasksperchild=1)
+
+
+def run_batch(projects, command_options=None, jobs=None, pythonpath='.'):
+    '''
+    Run the ``factorize`` command once per project.
+
+    Each project is handled by a fresh worker process, as Django can only
+    be configured once per interpreter. The worker runs from the project
+    directory, which is also added to its ``sys.path``.
+
+    Args:
+        projects (list): settings modules, optionally prefixed with the
+            project directory as ``directory:settings.module``.
+        command_options (dict): options passed to the ``factorize`` command.
+        jobs (int): number of worker processes. Defaults to the CPU count.
+        pythonpath (str): directory of the projects without one.
+
+    Returns:
+        list: a :py:class:`BatchResult` per project, in order.
+    '''
+    command_options = command_options or {}
+    tasks = [_parse_project(project, pythonpath) + (command_options, )
+             for project in projects]
+    if not tasks:
+        return []
+    pool = _get_pool(min(jobs or multiprocessing.cpu_count(), len(tasks)))
+    try:
+        return pool.map(_run_factorize, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _get_label(settings_module, directory):
+    return '{}:{}'.format(directory, settings_module)
+
+
+def _get_output_name(settings_module, directory):
+    return '{}-{}.txt'.format(os.path.basename(directory), settings_module)
+
+
+def _write_output(result, output_dir):
+    if output_dir is None:
+        print(color.bright_blue('# {}'.format(
+            _get_label(result.settings, result.directory))))
+        print(result.output)
+        return
+    path = os.path.join(output_dir, _get_output_name(result.settings,
+                                                     result.directory))
+    with io.open(path, 'w', encoding='utf-8') as output_file:
+        output_file.write(result.output)
+
+
+def _print_summary(results):
+    print(color.bright_white('Summary'))
+    for result in results:
+        if result.ok:
+            status = color.bright_green('OK')
+        else:
+            status = color.bright_red('FAILED')
+        print('  {} {} ({:.2f}s)'.format(
+            status, _get_label(result.settings, result.directory),
+            result.elapsed))
+    failed = sum(1 for result in results if not result.ok)
+    print('{} projects, {} failed'.format(len(results), failed))
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run factorize for several Django projects.')
+    parser.add_argument('projects', nargs='+', metavar='[DIR:]SETTINGS',
+                        help='Settings modules, one per project, optionally '
+                        'prefixed with the project directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes.')
+    parser.add_argument('--pythonpath', default='.',
+                        help='Directory of the projects given without one.')
+    parser.add_argument('--output-dir', default=None,
+                        help='Save each project output to '
+                        '<output-dir>/<project dir>-<settings>.txt instead '
+                        'of printing it.')
+    parser.add_argument('--report', choices=('text', 'jsonl'),
+                        default='text', help='factorize --report.')
+    parser.add_argument('--write', action='store_true', default=False,
+                        help='factorize --write.')
+    parser.add_argument('--write-jobs', type=int, default=4,
+                        help='factorize --jobs.')
+    parser.add_argument('--fsync', action='store_true', default=False,
+                        help='factorize --fsync.')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='factorize --force.')
+    parser.add_argument('--build-factories', action='store_true',
+                        default=False, help='factorize --build-factories.')
+    parser.add_argument('--costs', action='store_true', default=False,
+                        help='factorize --costs.')
+    parser.add_argument('--cost-threshold', type=int, default=10,
+                        help='factorize --cost-threshold.')
+    parser.add_argument('--cost-comments', action='store_true',
+                        default=False, help='factorize --cost-comments.')
+    parser.add_argument('--verify', action='store_true', default=False,
+                        help='factorize --verify, run in the project worker '
+                        'process itself.')
+    parser.add_argument('--dump-file', default=None,
+                        help='factorize --dump-file, relative to each '
+                        'project directory.')
+    parser.add_argument('--dump-depth', type=int, default=None,
+                        help='factorize --dump-depth.')
+    parser.add_argument('--dump-items', type=int, default=None,
+                        help='factorize --dump-items.')
+    return parser
+
+
+def main(argv=None):
+    parser = _get_parser()
+    options = parser.parse_args(argv)
+    if options.output_dir is not None:
+        names = collections.Counter(
+            _get_output_name(*_parse_project(project, options.pythonpath))
+            for project in options.projects)
+        duplicates = sorted(name for name, count in names.items()
+                            if count > 1)
+        if duplicates:
+            parser.error('Projects would share the output files {}'.format(
+                ', '.join(duplicates)))
+    command_options = {name: getattr(options, name)
+                       for name in _FACTORIZE_OPTIONS}
+    command_options['jobs'] = options.write_jobs
+    # Pool workers are daemonic and cannot start verification processes
+    command_options['verify_jobs'] = 1
+    results = run_batch(options.projects, command_options,
+                        jobs=options.jobs,
+                        pythonpath=options.pythonpath)
+    for result in results:
+        _write_output(result, options.output_dir)
+        if not result.ok:
+            print(color.red(result.error), file=sys.stderr)
+    _print_summary(results)
+    return 0 if all(result.ok for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
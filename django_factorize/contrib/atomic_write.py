@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Copyright (C) 2015 Ignacio Rossi
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library; if not, see <http://www.gnu.org/licenses/>.
+from __future__ import absolute_import, unicode_literals, division
+
+import io
+import logging
+import os
+import stat
+import uuid
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# os.rename cannot replace an existing file on Windows
+_replace = getattr(os, 'replace', os.rename)  # pylint: disable=invalid-name
+
+
+class AtomicWriteError(Exception):
+    '''
+    Some files given to :py:func:`atomic_write_many` could not be written.
+
+    Attributes:
+        written (list): the paths that were written.
+        errors (dict): the exception raised for each failed path.
+    '''
+
+    def __init__(self, written, errors):
+        super(AtomicWriteError, self).__init__(
+            'Could not write {} of {} files: {}'.format(
+                len(errors), len(written) + len(errors),
+                ', '.join(sorted(errors))))
+        self.written = written
+        self.errors = errors
+
+
+def _create_temp_file(path):
+    tmp_path = os.path.join(
+        os.path.dirname(path),
+        '.{}.{}.tmp'.format(os.path.basename(path), uuid.uuid4().hex))
+    # Like a plain open(): 0666 minus the umask, applied by the kernel
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    return fd, tmp_path
+
+
+def _fsync_directory(directory):
+    # Directories cannot be opened on Windows, where renames are durable
+    if os.name != 'posix':
+        return
+    fd = os.open(directory or os.curdir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, content, fsync=False, encoding='utf-8'):
+    '''
+    Write ``content`` to ``path`` so readers never see a partial file.
+
+    The content is written to a temporary file in the same directory, which
+    is then renamed over ``path``. New files get the usual permissions for
+    the current umask, replaced files keep their permissions.
+
+    Args:
+        path (str): destination path. Its directory must exist.
+        content (str): text to write.
+        fsync (bool): flush the temporary file to disk before renaming it,
+            and its directory after renaming it.
+        encoding (str): encoding used for ``content``.
+
+    Returns:
+        str: the written path.
+    '''
+    fd, tmp_path = _create_temp_file(path)
+    try:
+        with io.open(fd, 'w', encoding=encoding) as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            if fsync:
+                os.fsync(tmp_file.fileno())
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            pass
+        else:
+            os.chmod(tmp_path, mode)
+        _replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            logger.warning('Could not remove temporary file: %s', tmp_path)
+        raise
+    if fsync:
+        _fsync_directory(os.path.dirname(path))
+    logger.debug('Wrote %s', path)
+    return path
+
+
+def atomic_write_many(contents_by_path, jobs=4, fsync=False,
+                      encoding='utf-8'):
+    '''
+    Write several files with :py:func:`atomic_write` using a thread pool.
+
+    A failed file does not stop the others from being written.
+
+    Args:
+        contents_by_path (dict): content to write, keyed by path.
+        jobs (int): number of writer threads.
+        fsync (bool): flush each file and its directory to disk.
+        encoding (str): encoding used for the contents.
+
+    Returns:
+        list: the written paths, in ``contents_by_path`` order.
+
+    Raises:
+        AtomicWriteError: when some files could not be written.
+    '''
+    items = list(contents_by_path.items())
+
+    def write(item):
+        try:
+            return atomic_write(item[0], item[1], fsync=fsync,
+                                encoding=encoding), None
+        except Exception as error:  # pylint: disable=broad-except
+            return item[0], error
+
+    if jobs <= 1 or len(items) <= 1:
+        results = [write(item) for item in items]
+    else:
+        pool = ThreadPool(min(jobs, len(items)))
+        try:
+            results = list(pool.imap(write, items))
+        finally:
+            pool.close()
+            pool.join()
+
+    written = [path for path, error in results if error is None]
+    errors = {path: error for path, error in results if error is not None}
+    if errors:
+        raise AtomicWriteError(written, errors)
+    return written
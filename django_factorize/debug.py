@@ -4,21 +4,113 @@ from __future__ import absolute_import, division
 
 import collections
 import logging
-from pprint import PrettyPrinter  # pylint: disable=unused-import
+import sys
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+_VALUE = object()
+_TEXT = object()
+_CLOSE = object()
 
-class MyPrettyPrinter(PrettyPrinter):
-    def _format(self, thing, *args, **kwargs):
-        try:
-            as_dict = thing._asdict
-        except AttributeError:
-            if isinstance(thing, collections.OrderedDict):
-                thing = dict(thing)
-        else:
-            thing = dict(as_dict())
-        return PrettyPrinter._format(self, thing, *args, **kwargs)
 
+def _get_children(thing):
+    '''
+    Split a container in its opening text, closing text and its
+    ``(prefix, value)`` children. Returns ``None`` for leaves.
+    '''
+    fields = getattr(thing, '_fields', None)
+    if isinstance(thing, tuple) and fields is not None:
+        children = [(field + '=', value)
+                    for field, value in zip(fields, thing)]
+        return type(thing).__name__ + '(', ')', children
+    if isinstance(thing, dict):
+        keys = list(thing.keys())
+        if not isinstance(thing, collections.OrderedDict):
+            try:
+                keys.sort()
+            except TypeError:
+                pass
+        children = [(repr(key) + ': ', thing[key]) for key in keys]
+        return '{', '}', children
+    if isinstance(thing, list):
+        return '[', ']', [('', value) for value in thing]
+    if isinstance(thing, tuple):
+        return '(', ')', [('', value) for value in thing]
+    if isinstance(thing, (set, frozenset)):
+        return '{', '}', [('', value) for value in thing]
+    return None
 
-pprint = MyPrettyPrinter().pprint  # pylint: disable=invalid-name
+
+def dump(thing, stream=None, max_depth=None, max_items=None, indent=4):
+    '''
+    Write an indented representation of ``thing`` to ``stream``.
+
+    Namedtuples (like ``ModelData`` and ``FieldData``), dicts, lists, tuples
+    and sets are expanded, everything else is written with :py:func:`repr`.
+    The structure is walked iteratively, so deep graphs do not hit the
+    recursion limit. A container found inside itself is written as
+    ``<Recursion on ...>``, like :py:class:`pprint.PrettyPrinter` does.
+
+    Args:
+        thing: the object to dump.
+        stream: file-like object to write to. Defaults to ``sys.stdout``.
+        max_depth (int): containers nested deeper than this are written as
+            ``...``.
+        max_items (int): maximum children written per container.
+        indent (int): spaces added per nesting level.
+
+    >>> dump({'a': [1, 2, 3]}, max_items=2)
+    {
+        'a': [
+            1,
+            2,
+            ... (1 more)
+        ],
+    }
+    '''
+    stream = stream or sys.stdout
+    stack = [(_VALUE, thing, 0)]
+    # ids of the containers being written, to detect recursive ones
+    writing = set()
+    while stack:
+        kind, item, level = stack.pop()
+        if kind is _TEXT:
+            stream.write(item)
+            continue
+        if kind is _CLOSE:
+            thing_id, closing = item
+            writing.discard(thing_id)
+            stream.write(closing)
+            continue
+
+        split = _get_children(item)
+        if split is None:
+            stream.write(repr(item))
+            continue
+
+        opening, closing, children = split
+        if id(item) in writing:
+            stream.write('<Recursion on {} with id={}>'.format(
+                type(item).__name__, id(item)))
+            continue
+        if not children:
+            stream.write(opening + closing)
+            continue
+        if max_depth is not None and level >= max_depth:
+            stream.write(opening + '...' + closing)
+            continue
+
+        stream.write(opening + '\n')
+        writing.add(id(item))
+        child_indent = ' ' * (indent * (level + 1))
+        stack.append((_CLOSE, (id(item), ' ' * (indent * level) + closing),
+                      level))
+        if max_items is not None and len(children) > max_items:
+            stack.append((_TEXT, '{}... ({} more)\n'.format(
+                child_indent, len(children) - max_items), level))
+            children = children[:max_items]
+        for prefix, value in reversed(children):
+            stack.append((_TEXT, ',\n', level))
+            stack.append((_VALUE, value, level + 1))
+            stack.append((_TEXT, child_indent + prefix, level))
+    stream.write('\n')
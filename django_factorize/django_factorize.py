@@ -1 +1,215 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals, division
+
+import collections
+import logging
+import os
+
+from django.conf import settings
+from django.db import models
+
+try:
+    import django.apps
+    get_django_models = django.apps.apps.get_models  # pylint: disable=invalid-name
+except (ImportError, AttributeError):
+    from django.db.models import get_models as get_django_models  # pylint: disable=no-name-in-module
+
+from django_factorize.contrib.nt_with_defaults import namedtuple_with_defaults
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+NOTHING = object()
+
+FACTORIES_MODULE = 'test_factories'
+FACTORY_SUFFIX = 'Factory'
+
+_ModelInfo = collections.namedtuple('ModelInfo', ['module', 'name', 'app'])
+
+
+class ModelInfo(_ModelInfo):
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, model):
+        module = model.__module__
+        return cls(module=module,
+                   name=model.__name__,
+                   app=_get_app_for_module(module), )
+
+
+_ModelData = collections.namedtuple('ModelData', ['info', 'fields'])
+
+
+class ModelData(_ModelData):
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, model):
+        field_datas = collections.OrderedDict()  # Keep fields order
+        for field in model._meta.get_fields():  # pylint: disable=protected-access
+            if not _should_skip_field(model, field.name, field):
+                field_datas[field.name] = FieldData.from_field(field)
+        return cls(info=ModelInfo.from_model(model), fields=field_datas)
+
+_FieldData = namedtuple_with_defaults(
+    'FieldData',
+    ['model', 'name', 'field_type', 'default', 'is_relation',
+     'is_reverse_relation', 'is_many_to_many', 'related_model',
+     'related_name'],
+    defaults={
+        'default': NOTHING,
+        'is_relation': False,
+        'is_reverse_relation': False,
+        'is_many_to_many': False,
+        'related_model': None,
+        'related_name': None}
+)  # yapf: disable
+
+
+# pylint: disable=slots-on-old-class,too-few-public-methods
+class FieldData(_FieldData):
+    __slots__ = ()
+
+    @classmethod
+    def from_field(cls, field):
+        data = cls(model=ModelInfo.from_model(field.model),
+                   name=field.name,
+                   field_type=field.__class__.__name__)
+        try:
+            default = field.default
+        except AttributeError:
+            pass
+        else:
+            if default != models.NOT_PROVIDED:
+                data = data._replace(default=default)
+
+        if isinstance(field, (models.ForeignKey, models.OneToOneField)):
+            data = data._replace(
+                is_relation=True,
+                is_reverse_relation=False,
+                related_model=ModelInfo.from_model(field.related_model),
+                related_name=field.related.name, )
+        elif isinstance(field, models.ManyToManyField):
+            data = data._replace(
+                is_relation=True,
+                is_reverse_relation=False,
+                is_many_to_many=True,
+                related_model=ModelInfo.from_model(field.related_model),
+                related_name=field.related.name, )
+        elif isinstance(field, models.OneToOneRel):
+            related_model = ModelInfo.from_model(field.related_model)
+            data = data._replace(is_relation=True,
+                                 is_reverse_relation=True,
+                                 related_model=related_model, )
+        return data
+
+
+def _get_local_apps():
+    return [app for app in settings.INSTALLED_APPS if _is_local_module(app)]
+
+
+def _get_app_for_module(module):
+    for app in sorted(settings.INSTALLED_APPS, reverse=True):
+        if module.startswith(app):
+            return app
+    return None
+
+
+def _is_local_module(app_dotted_path):
+    app_path = app_dotted_path.replace('.', '/')
+    return os.path.isfile(os.path.join(
+        app_path, '__init__.py')) or os.path.isfile(app_path + '.py')
+
+
+def _get_field_data(field):
+    try:
+        default = field.default
+    except AttributeError:
+        default = NOTHING
+    else:
+        if default == models.NOT_PROVIDED:
+            default = NOTHING
+
+    data = {'field': field.__class__.__name__,
+            'relation': False,
+            'default': default}
+    if isinstance(field, models.ForeignKey):
+        data.update({'relation': True,
+                     'relation_reversed': False,
+                     'related_to': (field.related_model.__module__,
+                                    field.related_model.__name__)})
+    elif isinstance(field, models.ManyToOneRel):
+        data.update({'relation': True,
+                     'relation_reversed': True,
+                     'related_to': (field.related_model.__module__,
+                                    field.related_model.__name__)})
+
+    return data
+
+
+def _skip_reason(name, field):
+    if field.name != name:
+        return 'Field names do not match: "{}" != "{}"'.format(field.name,
+                                                               name)
+
+    if isinstance(field, models.DateTimeField) and (field.auto_now_add or
+                                                    field.auto_now):
+        return 'DateTimeField with auto_now or auto_now_add'
+
+    if isinstance(field, models.AutoField):
+        return 'AutoField'
+
+    # OneToOneRel is subclass of ManyToOneRel
+    if field.__class__ == models.ManyToOneRel:
+        return 'ManyToOneRel'
+
+    if isinstance(field, models.ManyToManyRel):
+        return 'ManyToManyRel'
+
+    return None
+
+
+def _should_skip_field(model, name, field):
+    reason = _skip_reason(name, field)
+    if reason is not None:
+        logger.debug('%s.%s: %s. Skipping', model.__name__, name, reason)
+    return reason is not None
+
+
+def _get_model_data(model):
+    meta = model._meta  # pylint: disable=protected-access
+    field_names = meta.get_all_field_names()
+    fields = {name: meta.get_field_by_name(name)[0]
+              for name in meta.get_all_field_names()}
+    field_datas = {name: FieldData.from_field(meta.get_field_by_name(name)[0])
+                   for name, field in fields.items()
+                   if not _should_skip_field(model, name, field)}
+    return {'data': ModelData.from_model(model),
+            'fields': field_datas,
+            'field_names': field_names}
+
+
+def get_related_model_data(field, models_by_app):
+    return models_by_app.get(field.related_model.app, {}).get(
+        field.related_model.name)
+
+
+def get_factory_path(model_info, suffix=FACTORY_SUFFIX):
+    return '{}.{}.{}{}'.format(model_info.app, FACTORIES_MODULE,
+                               model_info.name, suffix)
+
+
+def get_models_by_app():
+    local_apps = sorted(_get_local_apps(), reverse=True)
+    models_by_app = collections.defaultdict(dict)
+    for model in get_django_models():
+        app = _get_app_for_module(model.__module__)
+        if app in local_apps:
+            models_by_app[app][model.__name__] = ModelData.from_model(model)
+    return models_by_app
+
+
+def get_forward_relations(model_data):
+    return [field for field, field_data in model_data.fields.items()
+            if field_data.is_relation and not field_data.is_reverse_relation
+            and not field_data.is_many_to_many]
@@ -3,210 +3,208 @@
 from __future__ import (absolute_import, unicode_literals, division,
                         print_function)
 
+import ast
 import collections
+import importlib
+import json
 import logging
+import multiprocessing
 import os
 import textwrap
-from StringIO import StringIO
-
-from django.core.management.base import BaseCommand
-from django.conf import settings
-from django.db import models
+import traceback
+import types
 
 try:
-    import django.apps
-    get_django_models = django.apps.apps.get_models  # pylint: disable=invalid-name
-except (ImportError, AttributeError):
-    from django.db.models import get_models as get_django_models  # pylint: disable=no-name-in-module
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
 
 from django_factorize.contrib import color
-from django_factorize.contrib.nt_with_defaults import namedtuple_with_defaults
-from django_factorize.debug import pprint
+from django_factorize.contrib.atomic_write import (AtomicWriteError,
+                                                   atomic_write_many)
+from django_factorize.debug import dump
+from django_factorize.django_factorize import (
+    FACTORIES_MODULE, FACTORY_SUFFIX, NOTHING, get_factory_path,
+    get_forward_relations, get_models_by_app, get_related_model_data)
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
-_NOTHING = object()
-
-_ModelInfo = collections.namedtuple('ModelInfo', ['module', 'name', 'app'])
-
-
-class ModelInfo(_ModelInfo):
-    __slots__ = ()
-
-    @classmethod
-    def from_model(cls, model):
-        module = model.__module__
-        return cls(module=module,
-                   name=model.__name__,
-                   app=_get_app_for_module(module), )
-
-
-_ModelData = collections.namedtuple('ModelData', ['info', 'fields'])
-
-
-class ModelData(_ModelData):
-    __slots__ = ()
-
-    @classmethod
-    def from_model(cls, model):
-        field_datas = collections.OrderedDict()  # Keep fields order
-        for field in model._meta.get_fields():  # pylint: disable=protected-access
-            if not _should_skip_field(model, field.name, field):
-                field_datas[field.name] = FieldData.from_field(field)
-        return cls(info=ModelInfo.from_model(model), fields=field_datas)
-
-_FieldData = namedtuple_with_defaults(
-    'FieldData',
-    ['model', 'name', 'field_type', 'default', 'is_relation',
-     'is_reverse_relation', 'related_model', 'related_name'],
-    defaults={
-        'default': _NOTHING,
-        'is_relation': False,
-        'is_reverse_relation': False,
-        'related_model': None,
-        'related_name': None}
-)  # yapf: disable
-
-
-# pylint: disable=slots-on-old-class,too-few-public-methods
-class FieldData(_FieldData):
-    __slots__ = ()
-
-    @classmethod
-    def from_field(cls, field):
-        data = cls(model=ModelInfo.from_model(field.model),
-                   name=field.name,
-                   field_type=field.__class__.__name__)
-        try:
-            default = field.default
-        except AttributeError:
-            pass
-        else:
-            if default != models.NOT_PROVIDED:
-                data = data._replace(default=default)
-
-        if isinstance(field, (models.ForeignKey, models.OneToOneField)):
-            data = data._replace(
-                is_relation=True,
-                is_reverse_relation=False,
-                related_model=ModelInfo.from_model(field.related_model),
-                related_name=field.related.name, )
-        elif isinstance(field, models.OneToOneRel):
-            related_model = ModelInfo.from_model(field.related_model)
-            data = data._replace(is_relation=True,
-                                 is_reverse_relation=True,
-                                 related_model=related_model, )
-        return data
-
-
-def _get_local_apps():
-    return [app for app in settings.INSTALLED_APPS if _is_local_module(app)]
-
-
-def _get_app_for_module(module):
-    for app in sorted(settings.INSTALLED_APPS, reverse=True):
-        if module.startswith(app):
-            return app
-    return None
-
-
-def _is_local_module(app_dotted_path):
-    app_path = app_dotted_path.replace('.', '/')
-    return os.path.isfile(os.path.join(
-        app_path, '__init__.py')) or os.path.isfile(app_path + '.py')
-
-
-def _get_field_data(field):
-    try:
-        default = field.default
-    except AttributeError:
-        default = _NOTHING
-    else:
-        if default == models.NOT_PROVIDED:
-            default = _NOTHING
-
-    data = {'field': field.__class__.__name__,
-            'relation': False,
-            'default': default}
-    if isinstance(field, models.ForeignKey):
-        data.update({'relation': True,
-                     'relation_reversed': False,
-                     'related_to': (field.related_model.__module__,
-                                    field.related_model.__name__)})
-    elif isinstance(field, models.ManyToOneRel):
-        data.update({'relation': True,
-                     'relation_reversed': True,
-                     'related_to': (field.related_model.__module__,
-                                    field.related_model.__name__)})
-
-    return data
-
-
-def _skip_reason(name, field):
-    if field.name != name:
-        return 'Field names do not match: "{}" != "{}"'.format(field.name,
-                                                               name)
-
-    if isinstance(field, models.DateTimeField) and (field.auto_now_add or
-                                                    field.auto_now):
-        return 'DateTimeField with auto_now or auto_now_add'
-
-    if isinstance(field, models.AutoField):
-        return 'AutoField'
-
-    # OneToOneRel is subclass of ManyToOneRel
-    if field.__class__ == models.ManyToOneRel:
-        return 'ManyToOneRel'
-
-    return None
-
-
-def _should_skip_field(model, name, field):
-    reason = _skip_reason(name, field)
-    if reason is not None:
-        logger.debug('%s.%s: %s. Skipping', model.__name__, name, reason)
-    return reason is not None
-
+_STATUS_SUGGESTED = 'suggested'
+_STATUS_DEFAULT = 'default'
+_STATUS_MISSING = 'missing'
+
+_STATUS_COLORS = {
+    _STATUS_SUGGESTED: color.bright_green,
+    _STATUS_DEFAULT: color.bright_yellow,
+    _STATUS_MISSING: color.bright_red,
+}
+
+# Declarations whose first argument is a factory path
+_FACTORY_DECLARATIONS = ('SubFactory', 'RelatedFactory')
+
+# Generated modules executed by a verification worker, by module name
+_VERIFY_SOURCES = {}
+_VERIFY_MODULES = {}
+
+# Number of JSON lines buffered before each write to the output stream
+_REPORT_BUFFER_LINES = 512
+
+_BUILD_FACTORY_SUFFIX = 'BuildFactory'
+
+_MODULE_HEADER = textwrap.dedent('''\
+    # -*- coding: utf-8 -*-
+    from __future__ import absolute_import, unicode_literals
+
+    ''')
+
+_MANY_TO_MANY_HELPER_NAME = '_many_to_many'
+
+_MANY_TO_MANY_IMPORTS = (['import importlib'],
+                         ['from django.db import connections'])
+
+_MANY_TO_MANY_HELPER = textwrap.dedent('''
+
+    def {name}(field, factory_path=None, bulk=False):
+        """
+        post_generation hook for a ManyToManyField. Pass a list of objects or,
+        when there is a factory, the number of objects to create. Unsaved
+        objects are inserted in one query and attached in another one.
+
+        Query counts are only constant when objects can be bulk inserted:
+        with bulk=False (the related factory has SubFactory declarations,
+        whose rows must exist first) a count uses create_batch, one INSERT
+        per object, and backends that do not return primary keys from bulk
+        inserts save unsaved objects one by one.
+        """
+        def hook(obj, create, extracted, **kwargs):
+            if not create or not extracted:
+                return
+            manager = getattr(obj, field)
+            if isinstance(extracted, int):
+                if factory_path is None:
+                    raise ValueError("No factory for {{}}: pass a list of "
+                                     "objects".format(field))
+                module, name = factory_path.rsplit(".", 1)
+                factory_class = getattr(importlib.import_module(module), name)
+                if bulk:
+                    extracted = factory_class.build_batch(extracted, **kwargs)
+                else:
+                    extracted = factory_class.create_batch(extracted, **kwargs)
+            related_objs = list(extracted)
+
+            # Not pk: UUID and natural keys are set before saving
+            unsaved = [related for related in related_objs
+                       if related._state.adding]
+            features = connections[manager.db].features
+            if getattr(features, "can_return_rows_from_bulk_insert",
+                       getattr(features, "can_return_ids_from_bulk_insert",
+                               False)):
+                manager.model._default_manager.bulk_create(unsaved)
+            else:
+                for related in unsaved:
+                    related.save()
 
-def _get_model_data(model):
-    meta = model._meta  # pylint: disable=protected-access
-    field_names = meta.get_all_field_names()
-    fields = {name: meta.get_field_by_name(name)[0]
-              for name in meta.get_all_field_names()}
-    field_datas = {name: FieldData.from_field(meta.get_field_by_name(name)[0])
-                   for name, field in fields.items()
-                   if not _should_skip_field(model, name, field)}
-    return {'data': ModelData.from_model(model),
-            'fields': field_datas,
-            'field_names': field_names}
+            through = manager.through
+            if through._meta.auto_created:
+                manager.add(*related_objs)
+            else:
+                through._default_manager.bulk_create([
+                    through(**{{manager.source_field_name: obj,
+                               manager.target_field_name: related}})
+                    for related in related_objs])
+
+        return hook
+    ''').format(name=_MANY_TO_MANY_HELPER_NAME)
+
+_VALIDATE_RELATIONS_HELPER_NAME = '_validate_relations'
+
+_VALIDATE_RELATIONS_IMPORTS = (
+    [], ['from django.core.exceptions import ValidationError'])
+
+_VALIDATE_RELATIONS_HELPER = textwrap.dedent('''
+
+    def {name}(obj, fields):
+        """
+        Check the relations of a built instance without the database: required
+        relations must be set to an instance of the related model, and the
+        relations of unsaved related instances are checked the same way.
+        Other fields are not validated, as the factories do not declare most
+        of them. A relation set only by its id is accepted as is, without
+        loading the related instance.
+        """
+        pending = [(obj, fields)]
+        seen = set()
+        while pending:
+            instance, names = pending.pop()
+            if id(instance) in seen:
+                continue
+            seen.add(id(instance))
+            for name in names:
+                field = instance._meta.get_field(name)
+                label = "{{}}.{{}}".format(type(instance).__name__, name)
+                if hasattr(field, "is_cached"):
+                    cached = field.is_cached(instance)
+                else:
+                    cached = hasattr(instance, field.get_cache_name())
+                if cached:
+                    related = getattr(instance, name)
+                elif getattr(instance, field.attname) is not None:
+                    continue
+                else:
+                    related = None
+                if related is None:
+                    if not field.null:
+                        raise ValidationError({{name: label + " is required"}})
+                elif not isinstance(related, field.related_model):
+                    raise ValidationError({{name: "{{}} must be a {{}}".format(
+                        label, field.related_model.__name__)}})
+                elif related._state.adding:
+                    pending.append((related, [
+                        related_field.name
+                        for related_field in related._meta.concrete_fields
+                        if related_field.many_to_one or
+                        related_field.one_to_one]))
+    ''').format(name=_VALIDATE_RELATIONS_HELPER_NAME)
+
+FactoryCost = collections.namedtuple('FactoryCost',
+                                     ['rows', 'depth', 'fan_out', 'cyclic'])
+
+
+def _get_field_status(field_data, value):
+    if value != NOTHING:
+        return _STATUS_SUGGESTED
+    if field_data.default != NOTHING:
+        return _STATUS_DEFAULT
+    return _STATUS_MISSING
 
 
 def _get_field_status_color(field_data, value):
-    if value != _NOTHING:
-        return color.bright_green
-    if field_data.default != _NOTHING:
-        return color.bright_yellow
-    return color.bright_red
+    return _STATUS_COLORS[_get_field_status(field_data, value)]
 
 
 def _get_value(models_by_app, model, field, field_data, value):
-    if value != _NOTHING:
+    if value != NOTHING:
         return value
-    if field_data.default != _NOTHING:
-        return _NOTHING
+    if field_data.default != NOTHING:
+        return NOTHING
     if field_data.is_relation:
         if field_data.is_reverse_relation:
             return ''
-    return _NOTHING
+    return NOTHING
 
 
 def _generate_factory(name,
                       model,
                       fields,
                       comments=None,
-                      comment_missing_fields=True):
+                      comment_missing_fields=True,
+                      header_comment=None):
     comments = comments or {}
     code = StringIO()
+    if header_comment:
+        code.write('\n# ' + header_comment)
     code.write(textwrap.dedent('''
         class {name}(factory.DjangoModelFactory):
             class Meta(object):
@@ -216,7 +214,7 @@ def _generate_factory(name,
                     model=model))
     for field, value in fields.items():
         comment = comments.get(field)
-        if value != _NOTHING:
+        if value != NOTHING:
             code.write('    {} = {}'.format(field, value))
             if comment:
                 code.write('  # ' + comment)
@@ -229,6 +227,34 @@ def _generate_factory(name,
     return code.getvalue()
 
 
+def _generate_build_factory(name, parent, fields, relations):
+    code = StringIO()
+    code.write(textwrap.dedent('''
+        class {name}({parent}):
+            class Meta(object):
+                strategy = factory.BUILD_STRATEGY
+
+        ''').format(name=name,
+                    parent=parent))
+    overrides = [(field, value) for field, value in fields.items()
+                 if value != NOTHING]
+    for field, value in overrides:
+        code.write('    {} = {}\n'.format(field, value))
+    if overrides:
+        code.write('\n')
+    code.write(
+        '    @classmethod\n'
+        '    def _build(cls, model_class, *args, **kwargs):\n'
+        '        obj = super({name}, cls)._build(\n'
+        '            model_class, *args, **kwargs)\n'
+        '        {helper}(obj, [{relations}])\n'
+        '        return obj\n'.format(
+            name=name,
+            helper=_VALIDATE_RELATIONS_HELPER_NAME,
+            relations=', '.join('"{}"'.format(f) for f in relations)))
+    return code.getvalue()
+
+
 def _get_field_name_in_related_model(field, related_model):
     for related_field, field_data in related_model.fields.items():
         if (field_data.related_model == field.model and
@@ -237,82 +263,605 @@ def _get_field_name_in_related_model(field, related_model):
     return None
 
 
-def _get_suggested_field_values(model_data, models_by_app):
-    suggested = collections.defaultdict(lambda: _NOTHING)
+def _get_many_to_many_hook(name, field, models_by_app, factory_path):
+    related_model = get_related_model_data(field, models_by_app)
+    if related_model is None:
+        # Not a local model: there is no factory to create objects with
+        return 'factory.PostGeneration({}("{}"))'.format(
+            _MANY_TO_MANY_HELPER_NAME, name)
+    # Building objects with unsaved relations cannot be bulk inserted
+    bulk = not get_forward_relations(related_model)
+    return 'factory.PostGeneration({}("{}", "{}", bulk={}))'.format(
+        _MANY_TO_MANY_HELPER_NAME, name, factory_path, bulk)
+
+
+def _get_suggested_field_values(model_data, models_by_app,
+                                factory_suffix=FACTORY_SUFFIX):
+    suggested = collections.defaultdict(lambda: NOTHING)
     for name, field in model_data.fields.items():
-        value = _NOTHING
+        value = NOTHING
         if field.is_relation:
-            if field.is_reverse_relation:
+            factory_path = get_factory_path(field.related_model,
+                                            factory_suffix)
+            if field.is_many_to_many:
+                value = _get_many_to_many_hook(name, field, models_by_app,
+                                               factory_path)
+            elif field.is_reverse_relation:
                 # TODO(irossi): get reverse foreign key field
                 related_model = models_by_app[field.related_model.app][
                     field.related_model.name]
                 related_field = _get_field_name_in_related_model(
                     field, related_model)
                 if related_field:
-                    value = 'factory.RelatedFactory("{}.{}", "{}")'.format(
-                        field.related_model.app, field.related_model.name,
-                        related_field)
+                    value = 'factory.RelatedFactory("{}", "{}")'.format(
+                        factory_path, related_field)
             else:
-                value = 'factory.SubFactory("{}.{}")'.format(
-                    field.related_model.app, field.related_model.name)
+                value = 'factory.SubFactory("{}")'.format(factory_path)
             suggested[name] = value
     return suggested
 
 
+def _get_factory_edges(model_data, models_by_app):
+    """
+    Factories a single create() of ``model_data``'s factory also creates,
+    following the SubFactory and RelatedFactory declarations suggested by
+    :py:func:`_get_suggested_field_values`. Returns ``(field,
+    related_model_data, excluded_field)`` tuples, where
+    ``related_model_data`` is ``None`` for models without a generated
+    factory and ``excluded_field`` is the related model field a
+    RelatedFactory fills with the parent instance.
+    """
+    edges = []
+    for field in model_data.fields.values():
+        if not field.is_relation or field.is_many_to_many:
+            continue
+        related_model = get_related_model_data(field, models_by_app)
+        if not field.is_reverse_relation:
+            edges.append((field.name, related_model, None))
+        elif related_model is not None:
+            related_field = _get_field_name_in_related_model(field,
+                                                             related_model)
+            if related_field:
+                edges.append((field.name, related_model, related_field))
+    return edges
+
+
+def _get_cost_graph(models_by_app):
+    """
+    Factories created by each factory, keyed by ``(model_info,
+    excluded_field)``: a model reached through a RelatedFactory skips the
+    field pointing back to its parent, so it is a different node. Models
+    without a generated factory are ``None`` leaves.
+    """
+    model_datas = {model_data.info: model_data
+                   for app_models in models_by_app.values()
+                   for model_data in app_models.values()}
+    graph = {}
+    pending = [(info, None) for info in model_datas]
+    while pending:
+        key = pending.pop()
+        if key in graph:
+            continue
+        info, excluded_field = key
+        graph[key] = [None if related is None else (related.info, excluded)
+                      for field, related, excluded in _get_factory_edges(
+                          model_datas[info], models_by_app)
+                      if field != excluded_field]
+        pending.extend(child for child in graph[key] if child is not None)
+    return graph
+
+
+def _iter_components(graph):
+    """
+    Strongly connected components of ``graph``, with Tarjan's algorithm
+    unrolled into a loop. Every component comes after the components it
+    points to.
+    """
+    index, lowlink = {}, {}
+    stack, on_stack = [], set()
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            key, position = work.pop()
+            children = [child for child in graph[key] if child is not None]
+            if position == 0:
+                index[key] = lowlink[key] = len(index)
+                stack.append(key)
+                on_stack.add(key)
+            else:
+                # Back from the child visited last
+                lowlink[key] = min(lowlink[key],
+                                   lowlink[children[position - 1]])
+            for child_position in range(position, len(children)):
+                child = children[child_position]
+                if child not in index:
+                    work.extend([(key, child_position + 1), (child, 0)])
+                    break
+                if child in on_stack:
+                    lowlink[key] = min(lowlink[key], index[child])
+            else:
+                if lowlink[key] == index[key]:
+                    component = []
+                    while not component or component[-1] != key:
+                        component.append(stack.pop())
+                        on_stack.discard(component[-1])
+                    yield component
+
+
+def _get_factory_costs(models_by_app):
+    """
+    Estimate a single create() of every factory. Factories that reach a
+    SubFactory cycle are ``cyclic``, with unknown ``rows`` and ``depth``.
+
+    Returns:
+        dict: a :py:class:`FactoryCost` by model name, by app.
+    """
+    graph = _get_cost_graph(models_by_app)
+    leaf = FactoryCost(rows=1, depth=0, fan_out=0, cyclic=False)
+    costs = {}
+    for component in _iter_components(graph):
+        members = set(component)
+        outside = [leaf if child is None else costs[child]
+                   for key in component for child in graph[key]
+                   if child not in members]
+        fan_out = max([len(graph[key]) for key in component] +
+                      [child.fan_out for child in outside])
+        if (len(component) > 1 or component[0] in graph[component[0]] or
+                any(child.cyclic for child in outside)):
+            cost = FactoryCost(rows=None, depth=None, fan_out=fan_out,
+                               cyclic=True)
+        else:
+            cost = FactoryCost(
+                rows=1 + sum(child.rows for child in outside),
+                depth=max([0] + [child.depth + 1 for child in outside]),
+                fan_out=fan_out, cyclic=False)
+        for key in component:
+            costs[key] = cost
+    return {app: {model: costs[model_data.info, None]
+                  for model, model_data in app_models.items()}
+            for app, app_models in models_by_app.items()}
+
+
+def _get_cost_comment(cost):
+    if cost.cyclic:
+        return 'Estimated rows per create(): unbounded (SubFactory cycle)'
+    return 'Estimated rows per create(): {} (depth {}, fan-out {})'.format(
+        cost.rows, cost.depth, cost.fan_out)
+
+
+def _get_suggested_values(models_by_app):
+    return {app: {model: _get_suggested_field_values(model_data,
+                                                     models_by_app)
+                  for model, model_data in app_models.items()}
+            for app, app_models in models_by_app.items()}
+
+
+def _get_report_default(field_data):
+    if field_data.default == NOTHING:
+        return None
+    return field_data.default
+
+
+def _get_report_relation(field_data):
+    if not field_data.is_relation:
+        return None
+    return {'model': '{}.{}'.format(field_data.related_model.app,
+                                    field_data.related_model.name),
+            'reverse': field_data.is_reverse_relation,
+            'many_to_many': field_data.is_many_to_many}
+
+
+def _iter_field_records(models_by_app, values):
+    for app, app_models in models_by_app.items():
+        for model, model_data in app_models.items():
+            for field, field_data in model_data.fields.items():
+                value = values[app][model].get(field, NOTHING)
+                yield collections.OrderedDict([
+                    ('app', app),
+                    ('model', model),
+                    ('field', field),
+                    ('type', field_data.field_type),
+                    ('default', _get_report_default(field_data)),
+                    ('relation', _get_report_relation(field_data)),
+                    ('suggested', None if value == NOTHING else value),
+                    ('status', _get_field_status(field_data, value)),
+                ])  # yapf: disable
+
+
+def _write_jsonl_report(stream, records):
+    lines = []
+    for record in records:
+        # Defaults may be callables or other non serializable objects
+        lines.append(json.dumps(record, default=repr))
+        if len(lines) >= _REPORT_BUFFER_LINES:
+            stream.write('\n'.join(lines), ending='\n')
+            lines = []
+    if lines:
+        stream.write('\n'.join(lines), ending='\n')
+    stream.flush()
+
+
+def _get_factories_path(app):
+    app_path = os.path.join(*app.split("."))
+    return os.path.join(app_path, FACTORIES_MODULE + '.py')
+
+
+def _render_helper_imports(helper_imports):
+    stdlib = set()
+    third_party = {'import factory'}
+    for helper_stdlib, helper_third_party in helper_imports:
+        stdlib.update(helper_stdlib)
+        third_party.update(helper_third_party)
+    return ''.join('\n'.join(sorted(section)) + '\n\n'
+                   for section in (stdlib, third_party) if section)
+
+
+def _render_imports(app_models):
+    names_by_module = collections.defaultdict(list)
+    for model_data in app_models.values():
+        names_by_module[model_data.info.module].append(model_data.info.name)
+    return ''.join('from {} import {}\n'.format(module, ', '.join(
+        sorted(names))) for module, names in sorted(names_by_module.items()))
+
+
+def _has_many_to_many(app_models):
+    return any(field_data.is_many_to_many
+               for model_data in app_models.values()
+               for field_data in model_data.fields.values())
+
+
+def _render_build_factories(app_models, models_by_app):
+    code = StringIO()
+    for model, model_data in app_models.items():
+        suggested = _get_suggested_field_values(model_data, models_by_app,
+                                                _BUILD_FACTORY_SUFFIX)
+        # Many to many hooks do nothing when building
+        suggested = collections.OrderedDict(
+            (field, value) for field, value in suggested.items()
+            if not model_data.fields[field].is_many_to_many)
+        print(_generate_build_factory(model + _BUILD_FACTORY_SUFFIX,
+                                      model + FACTORY_SUFFIX, suggested,
+                                      get_forward_relations(model_data)),
+              file=code)
+    return code.getvalue()
+
+
+def _render_app_factories(app_models, app_values, models_by_app,
+                          build_factories=False, app_costs=None):
+    code = StringIO()
+    code.write(_MODULE_HEADER)
+    helpers = []
+    if _has_many_to_many(app_models):
+        helpers.append((_MANY_TO_MANY_IMPORTS, _MANY_TO_MANY_HELPER))
+    if build_factories:
+        helpers.append((_VALIDATE_RELATIONS_IMPORTS,
+                        _VALIDATE_RELATIONS_HELPER))
+    code.write(_render_helper_imports([imports for imports, _ in helpers]))
+    code.write(_render_imports(app_models))
+    for _, helper in helpers:
+        code.write(helper)
+    for model, model_data in app_models.items():
+        suggested = app_values[model]
+        field_values = collections.OrderedDict()
+        comments = {}
+        for field, field_data in model_data.fields.items():
+            if field in suggested:
+                value = suggested[field]
+            else:
+                value = NOTHING
+
+            field_values[field] = value
+
+            if field_data.default != NOTHING:
+                comments[field] = 'Has default: {}'.format(field_data.default)
+
+        header_comment = None
+        if app_costs is not None:
+            header_comment = _get_cost_comment(app_costs[model])
+
+        print(_generate_factory(model + FACTORY_SUFFIX, model, field_values,
+                                comments, header_comment=header_comment),
+              file=code)
+    if build_factories:
+        code.write(_render_build_factories(app_models, models_by_app))
+    return code.getvalue()
+
+
+def _render_factories(models_by_app, values, build_factories=False,
+                      costs=None):
+    return collections.OrderedDict(
+        (_get_factories_path(app),
+         _render_app_factories(app_models, values[app], models_by_app,
+                               build_factories,
+                               None if costs is None else costs[app]))
+        for app, app_models in sorted(models_by_app.items()))
+
+
+def _get_module_name(factories_path):
+    return os.path.splitext(factories_path)[0].replace(os.sep, '.')
+
+
+def _get_string_arg(node, index):
+    try:
+        arg = node.args[index]
+    except IndexError:
+        return None
+    # ast.Str before Python 3.8, ast.Constant after
+    value = getattr(arg, 'value', getattr(arg, 's', None))
+    return value if isinstance(value, type('')) else None
+
+
+def _get_factory_references(source):
+    references = []
+    for node in ast.walk(ast.parse(source)):
+        if not isinstance(node, ast.Call):
+            continue
+        if (isinstance(node.func, ast.Attribute) and
+                node.func.attr in _FACTORY_DECLARATIONS):
+            reference = _get_string_arg(node, 0)
+        elif (isinstance(node.func, ast.Name) and
+              node.func.id == _MANY_TO_MANY_HELPER_NAME):
+            reference = _get_string_arg(node, 1)
+        else:
+            continue
+        if reference is not None:
+            references.append((node.lineno, reference))
+    return references
+
+
+def _init_verify_worker(sources):
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+    _VERIFY_SOURCES.clear()
+    _VERIFY_SOURCES.update(sources)
+    _VERIFY_MODULES.clear()
+
+
+def _load_verify_module(module_name):
+    """
+    Execute a generated module from its source, or import it when it is not
+    one of the generated modules.
+    """
+    if module_name not in _VERIFY_SOURCES:
+        return importlib.import_module(module_name)
+    if module_name not in _VERIFY_MODULES:
+        factories_path, source = _VERIFY_SOURCES[module_name]
+        module = types.ModuleType(str(module_name))
+        module.__file__ = factories_path
+        try:
+            code = compile(source, factories_path, 'exec', dont_inherit=True)
+            exec(code, module.__dict__)  # pylint: disable=exec-used
+        except Exception as error:  # pylint: disable=broad-except
+            _VERIFY_MODULES[module_name] = error
+            raise
+        _VERIFY_MODULES[module_name] = module
+    module = _VERIFY_MODULES[module_name]
+    if isinstance(module, Exception):
+        raise ImportError('{} failed to load: {}'.format(module_name, module))
+    return module
+
+
+def _verify_module(module_name):
+    factories_path, source = _VERIFY_SOURCES[module_name]
+    try:
+        _load_verify_module(module_name)
+    except Exception as error:  # pylint: disable=broad-except
+        message = ''.join(traceback.format_exception_only(type(error), error))
+        return module_name, ['{}: {}'.format(factories_path, message.strip())]
+
+    errors = []
+    for lineno, reference in _get_factory_references(source):
+        reference_module, name = reference.rpartition('.')[::2]
+        try:
+            getattr(_load_verify_module(reference_module), name)
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append('{}:{}: cannot resolve "{}": {!r}'.format(
+                factories_path, lineno, reference, error))
+    return module_name, errors
+
+
+def _verify_factories(sources, jobs):
+    """
+    Compile and execute every generated module in Django-configured worker
+    processes and resolve the factory paths they reference.
+
+    Returns:
+        dict: error messages, keyed by the module name.
+    """
+    sources_by_module = {_get_module_name(factories_path):
+                         (factories_path, source)
+                         for factories_path, source in sources.items()}
+    module_names = sorted(sources_by_module)
+    if jobs <= 1 or len(module_names) <= 1:
+        _init_verify_worker(sources_by_module)
+        return dict(_verify_module(name) for name in module_names)
+
+    pool = multiprocessing.Pool(min(jobs, len(module_names)),
+                                initializer=_init_verify_worker,
+                                initargs=(sources_by_module, ))
+    try:
+        return dict(pool.imap_unordered(_verify_module, module_names))
+    finally:
+        pool.close()
+        pool.join()
+
+
+class _RawOutput(object):  # pylint: disable=too-few-public-methods
+    '''Write to a command output without its automatic line endings.'''
+
+    def __init__(self, output):
+        self._output = output
+
+    def write(self, text):
+        self._output.write(text, ending='')
+
+
 class Command(BaseCommand):
     help = "Factorize your app models."
 
-    def handle(self, *args, **options):
-        local_apps = sorted(_get_local_apps(), reverse=True)
-        models_by_app = collections.defaultdict(dict)
-        values = collections.defaultdict(dict)
-        for model in get_django_models():
-            app = _get_app_for_module(model.__module__)
-            if app in local_apps:
-                models_by_app[app][model.__name__] = ModelData.from_model(
-                    model)
-                values[app][model.__name__] = {}
-
-        pprint(dict(models_by_app))
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--report', choices=('text', 'jsonl'), default='text',
+            help='Field status report format. "jsonl" writes one JSON record '
+            'per field to stdout instead of the colored status and the '
+            'generated factories.')
+        parser.add_argument(
+            '--write', action='store_true', default=False,
+            help='Write the factories to each app\'s {}.py instead of '
+            'printing them.'.format(FACTORIES_MODULE))
+        parser.add_argument(
+            '--jobs', type=int, default=4,
+            help='Number of threads used to write the factory files.')
+        parser.add_argument(
+            '--fsync', action='store_true', default=False,
+            help='Flush each written file to disk before moving it into '
+            'place.')
+        parser.add_argument(
+            '--force', action='store_true', default=False,
+            help='Overwrite existing factory files when using --write.')
+        parser.add_argument(
+            '--build-factories', action='store_true', default=False,
+            help='Also generate a <Model>{} for each factory, which builds '
+            'unsaved instances and relations and validates them without '
+            'using the database.'.format(_BUILD_FACTORY_SUFFIX))
+        parser.add_argument(
+            '--costs', action='store_true', default=False,
+            help='Print the rows a single create() of each factory inserts, '
+            'with its SubFactory/RelatedFactory chain depth and fan-out.')
+        parser.add_argument(
+            '--cost-threshold', type=int, default=10,
+            help='Flag factories inserting more rows than this per create().')
+        parser.add_argument(
+            '--cost-comments', action='store_true', default=False,
+            help='Add the cost estimate as a comment above each factory.')
+        parser.add_argument(
+            '--verify', action='store_true', default=False,
+            help='Compile and import every generated module and resolve the '
+            'factories they reference, reporting all failures.')
+        parser.add_argument(
+            '--verify-jobs', type=int, default=None,
+            help='Number of verification processes. Defaults to the CPU '
+            'count.')
+        parser.add_argument(
+            '--dump-file', default=None,
+            help='Write the introspected models dump to this file instead '
+            'of stdout.')
+        parser.add_argument(
+            '--dump-depth', type=int, default=None,
+            help='Maximum nesting depth shown in the models dump.')
+        parser.add_argument(
+            '--dump-items', type=int, default=None,
+            help='Maximum items shown per container in the models dump.')
 
+    def handle(self, *args, **options):
+        models_by_app = get_models_by_app()
+        values = _get_suggested_values(models_by_app)
+
+        if options['report'] == 'jsonl':
+            _write_jsonl_report(self.stdout,
+                                _iter_field_records(models_by_app, values))
+            return
+
+        self._dump_models(models_by_app, options['dump_file'],
+                          options['dump_depth'], options['dump_items'])
+        self._print_field_status(models_by_app, values)
+        costs = None
+        if options['costs'] or options['cost_comments']:
+            costs = _get_factory_costs(models_by_app)
+        if options['costs']:
+            self._print_factory_costs(costs, options['cost_threshold'])
+        sources = _render_factories(
+            models_by_app, values, options['build_factories'],
+            costs if options['cost_comments'] else None)
+        if options['write']:
+            written = self._write_factories(sources, options['jobs'],
+                                            options['fsync'], options['force'])
+            # Skipped files were not generated now: only import them when
+            # a written module references them
+            sources = collections.OrderedDict(
+                (factories_path, sources[factories_path])
+                for factories_path in written)
+        else:
+            self._print_factories(sources)
+        if options['verify']:
+            self._verify_factories(sources, options['verify_jobs'] or
+                                   multiprocessing.cpu_count())
+
+    def _dump_models(self, models_by_app, dump_file, max_depth, max_items):
+        if dump_file is None:
+            dump(models_by_app, _RawOutput(self.stdout), max_depth, max_items)
+            return
+        with open(dump_file, 'w') as stream:
+            dump(models_by_app, stream, max_depth, max_items)
+
+    def _print_field_status(self, models_by_app, values):
         for app, app_models in models_by_app.items():
-            print(color.blue(app))
+            self.stdout.write(color.blue(app))
             for model, model_data in app_models.items():
-                print(color.magenta(" " + model))
+                self.stdout.write(color.magenta(" " + model))
                 for field, field_data in model_data.fields.items():
-                    value = values[app][model].get(field, _NOTHING)
-                    (models_by_app, model, field, field_data, _NOTHING)
+                    value = values[app][model].get(field, NOTHING)
                     status_color = _get_field_status_color(field_data, value)
-                    print(status_color('  - {} = {}'.format(field, _get_value(
-                        models_by_app, model, field, field_data, value))))
-
-        code = StringIO()
-        for app, app_models in models_by_app.items():
-            app_path = os.path.join(*app.split("."))
-            factories_path = os.path.join(app_path, 'test_factories.py')
-            print(color.green('#  {factories_path}\n'.format(factories_path=
-                                                             factories_path)),
-                  file=code)
-            for model, model_data in app_models.items():
-                suggested = _get_suggested_field_values(model_data,
-                                                        models_by_app)
-                values = collections.OrderedDict()
-                comments = {}
-                for field, field_data in model_data.fields.items():
-                    if field in suggested:
-                        value = suggested[field]
-                    else:
-                        value = _NOTHING
-
-                    values[field] = value
-
-                    if field_data.default != _NOTHING:
-                        comments[field] = 'Has default: {}'.format(
-                            field_data.default)
-
-                print(_generate_factory(model + "Factory", model, values,
-                                        comments),
-                      file=code)
-            print(file=code)
-
-        print(code.getvalue())
+                    self.stdout.write(status_color('  - {} = {}'.format(
+                        field, _get_value(models_by_app, model, field,
+                                          field_data, value))))
+
+    def _print_factory_costs(self, costs, threshold):
+        self.stdout.write(color.bright_white('Factory costs'))
+        for app, app_costs in sorted(costs.items()):
+            for model, cost in sorted(app_costs.items()):
+                line = '  {}.{}: {}'.format(app, model + FACTORY_SUFFIX,
+                                            _get_cost_comment(cost))
+                if cost.cyclic or cost.rows > threshold:
+                    line = color.bright_red(line + ' [above threshold]')
+                self.stdout.write(line)
+
+    def _print_factories(self, sources):
+        for factories_path, source in sources.items():
+            self.stdout.write(color.green('#  {factories_path}\n'.format(
+                factories_path=factories_path)))
+            self.stdout.write(source)
+
+    def _write_factories(self, sources, jobs, fsync, force):
+        if not force:
+            existing = [factories_path for factories_path in sources
+                        if os.path.exists(factories_path)]
+            for factories_path in existing:
+                self.stderr.write(color.yellow(
+                    'Skipped existing {}, use --force to overwrite it'.format(
+                        factories_path)))
+            sources = collections.OrderedDict(
+                (factories_path, source)
+                for factories_path, source in sources.items()
+                if factories_path not in existing)
+        try:
+            written = atomic_write_many(sources, jobs=jobs, fsync=fsync)
+            errors = {}
+        except AtomicWriteError as error:
+            written, errors = error.written, error.errors
+        for factories_path in written:
+            self.stdout.write(color.green('Wrote {}'.format(factories_path)))
+        for factories_path, error in sorted(errors.items()):
+            self.stderr.write(color.red('Could not write {}: {}'.format(
+                factories_path, error)))
+        self.stdout.write('{} factory files written'.format(len(written)))
+        if errors:
+            raise CommandError('{} factory files could not be written'.format(
+                len(errors)))
+        return written
+
+    def _verify_factories(self, sources, jobs):
+        errors = _verify_factories(sources, jobs)
+        failed = sorted(name for name, messages in errors.items() if messages)
+        for module_name in failed:
+            self.stderr.write(color.bright_red(module_name))
+            for message in errors[module_name]:
+                self.stderr.write(color.red(message))
+        if failed:
+            raise CommandError('{} of {} generated modules failed '
+                               'verification'.format(len(failed), len(errors)))
+        self.stdout.write(color.green('{} generated modules verified'.format(
+            len(errors))))
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# pylint: disable=protected-access
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+
+import collections
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import traceback
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import Max
+
+from django_factorize.contrib import color
+from django_factorize.contrib.atomic_write import atomic_write
+from django_factorize.django_factorize import (
+    get_factory_path, get_forward_relations, get_models_by_app,
+    get_related_model_data)
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# Related primary keys sampled for non unique relations, per worker process
+_PK_SAMPLE_SIZE = 10000
+_PK_SAMPLES = {}
+
+# Set by the parent once a chunk fails, so queued chunks are skipped
+_STOP = None
+
+_SeedTask = collections.namedtuple(
+    '_SeedTask',
+    ['label', 'factory_path', 'relations', 'after', 'chunk', 'start',
+     'size'])
+
+_ChunkResult = collections.namedtuple(
+    '_ChunkResult', ['label', 'chunk', 'done', 'error'])
+
+
+def _get_label(model_info):
+    return '{}.{}'.format(model_info.app, model_info.name)
+
+
+def _get_seed_order(models_by_app):
+    '''
+    Sort the local models so every model comes after the models its
+    forward relations point to. Models in relation cycles go last.
+    '''
+    model_datas = {_get_label(model_data.info): model_data
+                   for app_models in models_by_app.values()
+                   for model_data in app_models.values()}
+    dependencies = {}
+    for label, model_data in model_datas.items():
+        dependencies[label] = set()
+        for field in get_forward_relations(model_data):
+            field_data = model_data.fields[field]
+            related = get_related_model_data(field_data, models_by_app)
+            if related is not None:
+                dependencies[label].add(_get_label(related.info))
+        dependencies[label].discard(label)
+
+    order = []
+    pending = set(model_datas)
+    while pending:
+        ready = sorted(label for label in pending
+                       if not dependencies[label] & pending)
+        if not ready:
+            logger.warning('Relation cycle between %s. Seeding them last, '
+                           'their relations may fail', ', '.join(
+                               sorted(pending)))
+            ready = sorted(pending)
+        order.extend(ready)
+        pending.difference_update(ready)
+    return [model_datas[label] for label in order]
+
+
+def _close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+def _set_stop_event(stop):
+    global _STOP  # pylint: disable=global-statement
+    _STOP = stop
+
+
+def _init_worker(stop):
+    _set_stop_event(stop)
+    import django
+    if hasattr(django, 'setup'):
+        django.setup()
+    # Each worker opens its own database connections
+    _close_connections()
+    random.seed()
+
+
+def _import_factory(factory_path):
+    module, name = factory_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def _get_relation_values(model, field_name, after, start, size):
+    meta = model._meta
+    field = meta.get_field(field_name)
+    related_model = field.related_model
+    if related_model is model:
+        # Only nullable self relations get this far
+        return [None] * size
+
+    manager = related_model._default_manager
+    if field.unique:
+        # Each chunk takes its own slice of the rows not referenced yet, so
+        # no related row is used twice
+        queryset = manager.order_by('pk')
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+        pks = list(queryset.values_list('pk', flat=True)[start:start + size])
+        pks.extend([None] * (size - len(pks)))
+    else:
+        key = (related_model.__module__, related_model.__name__)
+        if key not in _PK_SAMPLES:
+            _PK_SAMPLES[key] = list(manager.order_by('?').values_list(
+                'pk', flat=True)[:_PK_SAMPLE_SIZE])
+        sample = _PK_SAMPLES[key]
+        pks = [random.choice(sample) if sample else None
+               for _ in range(size)]
+    return [None if pk is None else related_model(pk=pk) for pk in pks]
+
+
+def _get_last_related_pks(model, relations):
+    '''
+    Largest related primary key already referenced by each unique relation.
+    '''
+    meta = model._meta
+    last_pks = {}
+    for name in relations:
+        field = meta.get_field(name)
+        if field.unique:
+            last_pks[name] = model._default_manager.aggregate(
+                last=Max(field.attname))['last']
+    return last_pks
+
+
+def _check_relations(model, relations, rows, seeded, after):
+    '''
+    Refuse required relations that seeding ``rows`` rows of ``model`` cannot
+    fill. ``seeded`` holds the models already seeded by then, ``after`` the
+    :py:func:`_get_last_related_pks` of ``model``.
+    '''
+    meta = model._meta
+    for name in relations:
+        field = meta.get_field(name)
+        if field.null:
+            continue
+        related_model = field.related_model
+        label = '{}.{}'.format(model.__name__, name)
+        if related_model is model:
+            raise CommandError('{}: required relations to the same model '
+                               'cannot be seeded'.format(label))
+        if related_model in seeded:
+            available = rows
+        else:
+            queryset = related_model._default_manager.all()
+            if after.get(name) is not None:
+                queryset = queryset.filter(pk__gt=after[name])
+            available = queryset.count()
+        needed = rows if field.unique else 1
+        if available < needed:
+            raise CommandError('{}: needs {} {} rows, {} available'.format(
+                label, needed, related_model.__name__, available))
+
+
+def _insert_chunk(task):
+    factory_class = _import_factory(task.factory_path)
+    model = factory_class._meta.model
+    values = {field: _get_relation_values(model, field, task.after.get(field),
+                                          task.start, task.size)
+              for field in task.relations}
+    objs = [factory_class.build(**{field: field_values[index]
+                                   for field, field_values in values.items()})
+            for index in range(task.size)]
+    # All or nothing, so a failed chunk can simply be seeded again
+    with transaction.atomic(using=model._default_manager.db):
+        model._default_manager.bulk_create(objs)
+
+
+def _seed_chunk(task):
+    '''
+    Insert a chunk, returning a :py:class:`_ChunkResult` instead of raising
+    so the parent records every chunk that was inserted.
+    '''
+    if _STOP is not None and _STOP.is_set():
+        return _ChunkResult(task.label, task.chunk, done=False, error=None)
+    try:
+        _insert_chunk(task)
+    except Exception:  # pylint: disable=broad-except
+        return _ChunkResult(task.label, task.chunk, done=False,
+                            error=traceback.format_exc())
+    return _ChunkResult(task.label, task.chunk, done=True, error=None)
+
+
+class _Checkpoint(object):
+    '''
+    Chunks already seeded per model, saved as JSON after each chunk, along
+    with the :py:func:`_get_last_related_pks` of the run.
+    '''
+
+    def __init__(self, path, rows, chunk_size):
+        self.path = path
+        self.rows = rows
+        self.chunk_size = chunk_size
+        self.done = collections.defaultdict(set)
+        self.after = {}
+
+    @classmethod
+    def load(cls, path, rows, chunk_size):
+        checkpoint = cls(path, rows, chunk_size)
+        if path is None or not os.path.exists(path):
+            return checkpoint
+        with open(path) as checkpoint_file:
+            data = json.load(checkpoint_file)
+        if (data['rows'], data['chunk_size']) != (rows, chunk_size):
+            raise CommandError(
+                'Checkpoint {} was created with --rows={} --chunk-size={}'
+                .format(path, data['rows'], data['chunk_size']))
+        for label, chunks in data['done'].items():
+            checkpoint.done[label].update(chunks)
+        checkpoint.after.update(data.get('after', {}))
+        return checkpoint
+
+    def mark_done(self, label, chunk):
+        self.done[label].add(chunk)
+        if self.path is None:
+            return
+        atomic_write(self.path, json.dumps({
+            'rows': self.rows,
+            'chunk_size': self.chunk_size,
+            'done': {label: sorted(chunks)
+                     for label, chunks in self.done.items()},
+            'after': self.after,
+        }, cls=DjangoJSONEncoder))
+
+
+class Command(BaseCommand):
+    help = ("Seed the database with rows built by the generated factories, "
+            "in dependency order.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000,
+                            help='Rows to insert per model.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows per bulk insert.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes. Defaults to '
+                            'the CPU count.')
+        parser.add_argument('--checkpoint', default=None,
+                            help='JSON file recording the seeded chunks. '
+                            'An interrupted run resumes from it.')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        chunk_size = options['chunk_size']
+        if rows <= 0 or chunk_size <= 0:
+            raise CommandError('--rows and --chunk-size must be positive')
+        checkpoint = _Checkpoint.load(options['checkpoint'], rows, chunk_size)
+        model_datas = _get_seed_order(get_models_by_app())
+
+        seeded = set()
+        for model_data in model_datas:
+            label = _get_label(model_data.info)
+            model = self._get_factory(model_data)._meta.model
+            relations = get_forward_relations(model_data)
+            if label not in checkpoint.after:
+                checkpoint.after[label] = _get_last_related_pks(model,
+                                                                relations)
+            _check_relations(model, relations, rows, seeded,
+                             checkpoint.after[label])
+            seeded.add(model)
+
+        workers = options['workers'] or multiprocessing.cpu_count()
+        stop = multiprocessing.Event()
+        if workers > 1:
+            # Forked workers must not share the parent connections
+            _close_connections()
+            pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                        initargs=(stop, ))
+            run = pool.imap_unordered
+        else:
+            _set_stop_event(stop)
+            pool = None
+            run = map
+        failed = True
+        try:
+            for model_data in model_datas:
+                self._seed_model(model_data, rows, chunk_size, checkpoint, run,
+                                 stop)
+            failed = False
+        finally:
+            if pool is not None:
+                # Every finished chunk is recorded by now
+                if failed:
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+
+    @staticmethod
+    def _get_factory(model_data):
+        factory_path = get_factory_path(model_data.info)
+        try:
+            return _import_factory(factory_path)
+        except (ImportError, AttributeError):
+            raise CommandError('Could not import {}. Generate it with '
+                               '"factorize --write" first'.format(
+                                   factory_path))
+
+    def _seed_model(self, model_data, rows, chunk_size, checkpoint, run,
+                    stop):
+        label = _get_label(model_data.info)
+        relations = get_forward_relations(model_data)
+        tasks = [_SeedTask(label=label,
+                           factory_path=get_factory_path(model_data.info),
+                           relations=relations,
+                           after=checkpoint.after[label],
+                           chunk=chunk,
+                           start=chunk * chunk_size,
+                           size=min(chunk_size, rows - chunk * chunk_size))
+                 for chunk in range((rows + chunk_size - 1) // chunk_size)
+                 if chunk not in checkpoint.done[label]]
+        if not tasks:
+            self.stdout.write(color.yellow('{}: already seeded'.format(
+                label)))
+            return
+
+        errors = []
+        for result in run(_seed_chunk, tasks):
+            if result.done:
+                checkpoint.mark_done(result.label, result.chunk)
+            elif result.error is not None:
+                errors.append(result)
+                stop.set()
+        if errors:
+            for result in sorted(errors):
+                self.stderr.write(color.red('{} chunk {} failed:\n{}'.format(
+                    result.label, result.chunk, result.error)))
+            raise CommandError(
+                '{}: {} chunks failed, {} seeded. Run again with the same '
+                '--checkpoint to resume'.format(
+                    label, len(errors), len(checkpoint.done[label])))
+        self.stdout.write(color.green('{}: {} rows in {} chunks'.format(
+            label, sum(task.size for task in tasks), len(tasks))))
@@ -41,4 +41,9 @@ setup(
         'Programming Language :: Python :: 3.4',
     ],
     test_suite='tests',
+    entry_points={
+        'console_scripts': [
+            'django-factorize-batch = django_factorize.batch:main',
+        ],
+    },
 )
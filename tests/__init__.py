@@ -1 +1,8 @@
 # -*- coding: utf-8 -*-
+
+from django.conf import settings
+
+# Configured once for the whole test run: the verify stage calls
+# django.setup(), which needs settings
+if not settings.configured:
+    settings.configure(INSTALLED_APPS=['django_factorize'])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=protected-access,invalid-name
+
+"""
+test_atomic_write
+----------------------------------
+
+Tests for `django_factorize.contrib.atomic_write` module.
+"""
+
+import collections
+import io
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django_factorize.contrib import atomic_write as atomic_write_module
+from django_factorize.contrib.atomic_write import (AtomicWriteError,
+                                                   atomic_write,
+                                                   atomic_write_many)
+
+
+def _read(path):
+    with io.open(path, encoding='utf-8') as read_file:
+        return read_file.read()
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test_factories.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write(self):
+        self.assertEqual(atomic_write(self.path, u'x = 1\n', fsync=True),
+                         self.path)
+        self.assertEqual(_read(self.path), u'x = 1\n')
+        self.assertEqual(os.listdir(self.directory), ['test_factories.py'])
+
+    @unittest.skipUnless(os.name == 'posix', 'directories are not synced')
+    def test_fsync_directory(self):
+        with mock.patch.object(os, 'fsync') as fsync:
+            atomic_write(self.path, u'x = 1\n', fsync=True)
+        self.assertEqual(fsync.call_count, 2)
+        with mock.patch.object(os, 'fsync') as fsync:
+            atomic_write(self.path, u'x = 1\n')
+        self.assertFalse(fsync.called)
+
+    def test_replace(self):
+        atomic_write(self.path, u'old\n')
+        atomic_write(self.path, u'new\n')
+        self.assertEqual(_read(self.path), u'new\n')
+        self.assertEqual(os.listdir(self.directory), ['test_factories.py'])
+
+    def test_error_keeps_destination_and_cleans_up(self):
+        atomic_write(self.path, u'old\n')
+        with self.assertRaises(TypeError):
+            atomic_write(self.path, object())
+        self.assertEqual(_read(self.path), u'old\n')
+        self.assertEqual(os.listdir(self.directory), ['test_factories.py'])
+
+    def test_new_file_permissions_follow_umask(self):
+        umask = os.umask(0o027)
+        try:
+            atomic_write(self.path, u'x = 1\n')
+        finally:
+            os.umask(umask)
+        self.assertEqual(_mode(self.path), 0o640)
+
+    def test_replaced_file_keeps_permissions(self):
+        atomic_write(self.path, u'old\n')
+        os.chmod(self.path, 0o600)
+        atomic_write(self.path, u'new\n')
+        self.assertEqual(_mode(self.path), 0o600)
+
+    def test_write_many(self):
+        contents = [(os.path.join(self.directory, '{}.py'.format(index)),
+                     u'x = {}\n'.format(index)) for index in range(20)]
+        written = atomic_write_many(dict(contents), jobs=4)
+        self.assertEqual(sorted(written), sorted(path for path, _ in contents))
+        for path, content in contents:
+            self.assertEqual(_read(path), content)
+
+    def test_write_many_keeps_order(self):
+        paths = [os.path.join(self.directory, name) for name in 'cab']
+        contents = collections.OrderedDict((path, u'') for path in paths)
+        self.assertEqual(atomic_write_many(contents, jobs=3), paths)
+
+    def test_write_many_reports_failures(self):
+        missing = os.path.join(self.directory, 'missing', 'b.py')
+        paths = [os.path.join(self.directory, name)
+                 for name in ('a.py', 'c.py', 'd.py')]
+        contents = collections.OrderedDict(
+            [(paths[0], u'a'), (missing, u'b'), (paths[1], u'c'),
+             (paths[2], u'd')])
+        for jobs in (1, 3):
+            with self.assertRaises(AtomicWriteError) as context:
+                atomic_write_many(contents, jobs=jobs)
+            self.assertEqual(context.exception.written, paths)
+            self.assertEqual(list(context.exception.errors), [missing])
+            self.assertIsInstance(context.exception.errors[missing], OSError)
+            for path in paths:
+                self.assertTrue(os.path.exists(path))
+
+    def test_replace_uses_os_replace(self):
+        if not hasattr(os, 'replace'):
+            self.skipTest('os.replace is not available')
+        self.assertIs(atomic_write_module._replace, os.replace)
+
+
+if __name__ == '__main__':
+    unittest.main()
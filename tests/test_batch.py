@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=protected-access,invalid-name
+
+"""
+test_batch
+----------------------------------
+
+Tests for `django_factorize.batch` module.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+
+from django_factorize import batch
+
+_SETTINGS = textwrap.dedent('''\
+    SECRET_KEY = 'test'
+    INSTALLED_APPS = ['django_factorize', '{app}']
+    DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+    ''')
+
+_MODELS = textwrap.dedent('''\
+    from django.db import models
+
+
+    class {model}(models.Model):
+        name = models.CharField(max_length=10)
+    ''')
+
+
+def _write(path, content):
+    with io.open(path, 'w', encoding='utf-8') as write_file:
+        write_file.write(content)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        self.shop = self._project('shop_project', 'shop', 'Item')
+        self.blog = self._project('blog_project', 'blog', 'Post')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def _project(self, name, app, model):
+        project = os.path.join(self.directory, name)
+        os.makedirs(os.path.join(project, app))
+        _write(os.path.join(project, name + '_settings.py'),
+               _SETTINGS.format(app=app))
+        _write(os.path.join(project, app, '__init__.py'), u'')
+        _write(os.path.join(project, app, 'models.py'),
+               _MODELS.format(model=model))
+        return '{}:{}_settings'.format(project, name)
+
+    def test_run_batch(self):
+        results = batch.run_batch([self.shop, self.blog, 'missing.settings'],
+                                  jobs=2, pythonpath=self.directory)
+        self.assertEqual([result.settings for result in results],
+                         ['shop_project_settings', 'blog_project_settings',
+                          'missing.settings'])
+        self.assertEqual([result.directory for result in results],
+                         [os.path.join(self.directory, 'shop_project'),
+                          os.path.join(self.directory, 'blog_project'),
+                          os.path.abspath(self.directory)])
+        self.assertEqual([result.ok for result in results],
+                         [True, True, False])
+        self.assertIn('class ItemFactory', results[0].output)
+        self.assertIn(os.path.join('shop', 'test_factories.py'),
+                      results[0].output)
+        self.assertNotIn('PostFactory', results[0].output)
+        self.assertIn('class PostFactory', results[1].output)
+        self.assertIn('missing', results[2].error)
+
+    def test_write_in_project_directory(self):
+        results = batch.run_batch([self.shop], {'write': True})
+        self.assertTrue(results[0].ok, results[0].error)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.shop.rpartition(':')[0], 'shop', 'test_factories.py')))
+
+    def test_main(self):
+        output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(output_dir)
+        self.assertEqual(batch.main([self.shop, '--output-dir', output_dir]),
+                         0)
+        output_path = os.path.join(output_dir,
+                                   'shop_project-shop_project_settings.txt')
+        with io.open(output_path, encoding='utf-8') as output_file:
+            self.assertIn('class ItemFactory', output_file.read())
+        self.assertEqual(batch.main([self.shop, 'missing.settings',
+                                     '--output-dir', output_dir]), 1)
+
+    def test_main_forwards_options(self):
+        output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(output_dir)
+        self.assertEqual(batch.main([self.shop, '--output-dir', output_dir,
+                                     '--costs', '--cost-comments',
+                                     '--build-factories']), 0)
+        output_path = os.path.join(output_dir,
+                                   'shop_project-shop_project_settings.txt')
+        with io.open(output_path, encoding='utf-8') as output_file:
+            output = output_file.read()
+        self.assertIn('Factory costs', output)
+        self.assertIn('# Estimated rows per create(): 1', output)
+        self.assertIn('class ItemBuildFactory', output)
+
+    def test_same_settings_name(self):
+        other_shop = os.path.join(self.directory, 'other', 'shop_project')
+        shutil.copytree(self.shop.rpartition(':')[0], other_shop)
+        projects = [self.shop, other_shop + ':shop_project_settings']
+        results = batch.run_batch(projects)
+        self.assertEqual([result.ok for result in results], [True, True])
+        self.assertNotEqual(results[0].directory, results[1].directory)
+
+        output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(output_dir)
+        with self.assertRaises(SystemExit):
+            batch.main(projects + ['--output-dir', output_dir])
+        self.assertEqual(os.listdir(output_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
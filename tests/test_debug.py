@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=protected-access,invalid-name
+
+"""
+test_debug
+----------------------------------
+
+Tests for `django_factorize.debug` module.
+"""
+
+import collections
+import textwrap
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from django_factorize.debug import dump
+
+Pair = collections.namedtuple('Pair', ['first', 'second'])
+
+
+class TestDump(unittest.TestCase):
+
+    def _dump(self, thing, **kwargs):
+        stream = StringIO()
+        dump(thing, stream, **kwargs)
+        return stream.getvalue()
+
+    def test_leaf(self):
+        self.assertEqual(self._dump(3), '3\n')
+
+    def test_namedtuple_and_ordered_dict(self):
+        thing = collections.OrderedDict([('b', Pair(1, [])), ('a', None)])
+        self.assertEqual(self._dump(thing), textwrap.dedent('''\
+            {
+                'b': Pair(
+                    first=1,
+                    second=[],
+                ),
+                'a': None,
+            }
+            '''))
+
+    def test_max_depth(self):
+        self.assertEqual(self._dump([[1], 2], max_depth=1),
+                         textwrap.dedent('''\
+            [
+                [...],
+                2,
+            ]
+            '''))
+
+    def test_max_items(self):
+        self.assertEqual(self._dump((1, 2, 3), max_items=1),
+                         textwrap.dedent('''\
+            (
+                1,
+                ... (2 more)
+            )
+            '''))
+
+    def test_deep_nesting(self):
+        thing = []
+        for _ in range(10000):
+            thing = [thing]
+        self.assertTrue(self._dump(thing).endswith(']\n'))
+
+    def test_recursion(self):
+        thing = [1]
+        thing.append(thing)
+        self.assertEqual(self._dump(thing), textwrap.dedent('''\
+            [
+                1,
+                <Recursion on list with id={}>,
+            ]
+            ''').format(id(thing)))
+
+    def test_shared_containers(self):
+        shared = [1]
+        self.assertEqual(self._dump([shared, shared]), textwrap.dedent('''\
+            [
+                [
+                    1,
+                ],
+                [
+                    1,
+                ],
+            ]
+            '''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=protected-access,invalid-name
+
+"""
+test_factorize
+----------------------------------
+
+Tests for the `factorize` management command.
+"""
+
+import collections
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django_factorize.django_factorize import FieldData, ModelData, ModelInfo
+from django_factorize.management.commands import factorize
+
+
+def _model_info(app, name):
+    return ModelInfo(module=app + '.models', name=name, app=app)
+
+
+def _model_data(info, fields):
+    return ModelData(info=info, fields=collections.OrderedDict(
+        (field.name, field) for field in fields))
+
+
+def _models_by_app(*model_datas):
+    models_by_app = collections.defaultdict(dict)
+    for model_data in model_datas:
+        models_by_app[model_data.info.app][model_data.info.name] = model_data
+    return models_by_app
+
+
+ITEM = _model_info('shop', 'Item')
+OWNER = _model_info('shop', 'Owner')
+
+
+def _shop_models():
+    item = _model_data(ITEM, [
+        FieldData(model=ITEM, name='name', field_type='CharField',
+                  default=''),
+        FieldData(model=ITEM, name='owner', field_type='ForeignKey',
+                  is_relation=True, related_model=OWNER,
+                  related_name='items'),
+    ])
+    owner = _model_data(OWNER, [
+        FieldData(model=OWNER, name='email', field_type='EmailField'),
+    ])
+    return _models_by_app(item, owner)
+
+
+class _Stream(object):
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text, ending=None):
+        self.writes.append(text + (ending or ''))
+
+    def flush(self):
+        pass
+
+
+class TestJsonlReport(unittest.TestCase):
+
+    def setUp(self):
+        self.models_by_app = _shop_models()
+        self.values = factorize._get_suggested_values(self.models_by_app)
+
+    def _records(self):
+        return list(factorize._iter_field_records(self.models_by_app,
+                                                  self.values))
+
+    def test_records(self):
+        records = {(r['model'], r['field']): r for r in self._records()}
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records['Item', 'name'], {
+            'app': 'shop',
+            'model': 'Item',
+            'field': 'name',
+            'type': 'CharField',
+            'default': '',
+            'relation': None,
+            'suggested': None,
+            'status': 'default',
+        })
+        self.assertEqual(records['Item', 'owner']['relation'], {
+            'model': 'shop.Owner',
+            'reverse': False,
+            'many_to_many': False,
+        })
+        self.assertEqual(records['Item', 'owner']['suggested'],
+                         'factory.SubFactory('
+                         '"shop.test_factories.OwnerFactory")')
+        self.assertEqual(records['Item', 'owner']['status'], 'suggested')
+        self.assertEqual(records['Owner', 'email']['default'], None)
+        self.assertEqual(records['Owner', 'email']['status'], 'missing')
+
+    def test_non_serializable_default(self):
+        field = FieldData(model=OWNER, name='created',
+                          field_type='DateTimeField', default=len)
+        self.models_by_app['shop']['Owner'].fields['created'] = field
+        stream = _Stream()
+        factorize._write_jsonl_report(stream, self._records())
+        lines = ''.join(stream.writes).splitlines()
+        self.assertEqual(json.loads(lines[-1])['default'], repr(len))
+
+    def test_buffered_writes(self):
+        stream = _Stream()
+        with mock.patch.object(factorize, '_REPORT_BUFFER_LINES', 2):
+            factorize._write_jsonl_report(stream, self._records())
+        self.assertEqual(len(stream.writes), 2)
+        lines = ''.join(stream.writes).splitlines()
+        self.assertEqual([json.loads(line)['field'] for line in lines],
+                         ['name', 'owner', 'email'])
+
+
+class TestBuildFactories(unittest.TestCase):
+
+    def _render(self):
+        models_by_app = _shop_models()
+        values = factorize._get_suggested_values(models_by_app)
+        sources = factorize._render_factories(models_by_app, values,
+                                              build_factories=True)
+        return sources['shop/test_factories.py']
+
+    def test_only_relations_are_validated(self):
+        source = self._render()
+        compile(source, 'test_factories.py', 'exec')
+        self.assertIn('class ItemBuildFactory(ItemFactory):', source)
+        self.assertIn('owner = factory.SubFactory('
+                      '"shop.test_factories.OwnerBuildFactory")', source)
+        self.assertIn('_validate_relations(obj, ["owner"])', source)
+        self.assertIn('_validate_relations(obj, [])', source)
+        self.assertNotIn('full_clean', source)
+
+    def test_imports(self):
+        source = self._render()
+        self.assertIn('from django.core.exceptions import ValidationError\n'
+                      'import factory\n\n'
+                      'from shop.models import Item, Owner\n', source)
+
+
+class _Owner(object):
+    pass
+
+
+class _Item(object):
+
+    def __init__(self, owner_id=None, **cached):
+        self.owner_id = owner_id
+        self.cached = cached
+
+    @property
+    def owner(self):
+        if 'owner' not in self.cached:
+            raise AssertionError('the related owner was loaded')
+        return self.cached['owner']
+
+
+class TestValidateRelations(unittest.TestCase):
+
+    def setUp(self):
+        from django.core.exceptions import ValidationError
+        namespace = {'ValidationError': ValidationError}
+        helper = factorize._VALIDATE_RELATIONS_HELPER
+        exec(helper, namespace)  # pylint: disable=exec-used
+        self.validate = namespace[factorize._VALIDATE_RELATIONS_HELPER_NAME]
+        self.error = ValidationError
+        field = mock.Mock(attname='owner_id', null=False,
+                          related_model=_Owner)
+        field.is_cached.side_effect = lambda item: 'owner' in item.cached
+        _Item._meta = mock.Mock()
+        _Item._meta.get_field.return_value = field
+        _Owner._meta = mock.Mock(concrete_fields=[])
+        _Owner._state = mock.Mock(adding=True)
+
+    def test_related_instance(self):
+        self.validate(_Item(owner=_Owner()), ['owner'])
+        with self.assertRaises(self.error):
+            self.validate(_Item(owner=object()), ['owner'])
+
+    def test_related_id_is_not_loaded(self):
+        self.validate(_Item(owner_id=1), ['owner'])
+
+    def test_required(self):
+        with self.assertRaises(self.error) as context:
+            self.validate(_Item(), ['owner'])
+        self.assertIn('_Item.owner is required', str(context.exception))
+        with self.assertRaises(self.error):
+            self.validate(_Item(owner=None), ['owner'])
+
+
+PLACE = _model_info('shop', 'Place')
+RESTAURANT = _model_info('shop', 'Restaurant')
+
+
+def _one_to_one_models(reverse=False):
+    place = _model_data(PLACE, [
+        FieldData(model=PLACE, name='restaurant',
+                  field_type='OneToOneRel', is_relation=True,
+                  is_reverse_relation=True, related_model=RESTAURANT,
+                  related_name='place'),
+    ])
+    restaurant = _model_data(RESTAURANT, [
+        FieldData(model=RESTAURANT, name='place',
+                  field_type='OneToOneField', is_relation=True,
+                  related_model=PLACE, related_name='restaurant'),
+    ])
+    if reverse:
+        return _models_by_app(restaurant, place)
+    return _models_by_app(place, restaurant)
+
+
+def _foreign_key(model, name, related_model):
+    return FieldData(model=model, name=name, field_type='ForeignKey',
+                     is_relation=True, related_model=related_model,
+                     related_name=model.name.lower() + '_' + name)
+
+
+class TestFactoryCosts(unittest.TestCase):
+
+    def _cost(self, models_by_app, name):
+        return factorize._get_factory_costs(models_by_app)['shop'][name]
+
+    def test_sub_factory(self):
+        models_by_app = _shop_models()
+        self.assertEqual(self._cost(models_by_app, 'Item'),
+                         factorize.FactoryCost(rows=2, depth=1, fan_out=1,
+                                               cyclic=False))
+
+    def test_one_to_one(self):
+        # Restaurant -> Place -> RelatedFactory(Restaurant, place=...)
+        models_by_app = _one_to_one_models()
+        self.assertEqual(self._cost(models_by_app, 'Restaurant'),
+                         factorize.FactoryCost(rows=3, depth=2, fan_out=1,
+                                               cyclic=False))
+        self.assertEqual(self._cost(models_by_app, 'Place'),
+                         factorize.FactoryCost(rows=2, depth=1, fan_out=1,
+                                               cyclic=False))
+
+    def test_one_to_one_order(self):
+        self.assertEqual(
+            factorize._get_factory_costs(_one_to_one_models()),
+            factorize._get_factory_costs(_one_to_one_models(reverse=True)))
+
+    def test_sub_factory_cycle(self):
+        models_by_app = _shop_models()
+        models_by_app['shop']['Owner'].fields['item'] = FieldData(
+            model=OWNER, name='item', field_type='ForeignKey',
+            is_relation=True, related_model=ITEM, related_name='owners')
+        for name in ('Item', 'Owner'):
+            cost = self._cost(models_by_app, name)
+            self.assertTrue(cost.cyclic)
+            self.assertIsNone(cost.rows)
+
+    def test_large_cycle(self):
+        # Every path through the cycle used to be walked: 12! here
+        infos = [_model_info('shop', 'Model{}'.format(index))
+                 for index in range(12)]
+        model_datas = [_model_data(info, [
+            _foreign_key(info, 'to_' + other.name.lower(), other)
+            for other in infos if other != info]) for info in infos]
+        leaf = _model_info('shop', 'Leaf')
+        entry = _model_info('shop', 'Entry')
+        chain = _model_info('shop', 'Chain')
+        models_by_app = _models_by_app(
+            _model_data(entry, [_foreign_key(entry, 'model', infos[0])]),
+            _model_data(chain, [_foreign_key(chain, 'leaf', leaf),
+                                _foreign_key(chain, 'other', leaf)]),
+            _model_data(leaf, []),
+            *model_datas)
+        costs = factorize._get_factory_costs(models_by_app)['shop']
+        for info in infos + [entry]:
+            self.assertTrue(costs[info.name].cyclic, info.name)
+            self.assertIsNone(costs[info.name].rows)
+        self.assertEqual(costs['Model0'].fan_out, 11)
+        self.assertEqual(costs['Chain'],
+                         factorize.FactoryCost(rows=3, depth=1, fan_out=2,
+                                               cyclic=False))
+        self.assertEqual(costs['Leaf'],
+                         factorize.FactoryCost(rows=1, depth=0, fan_out=0,
+                                               cyclic=False))
+
+    def test_self_sub_factory(self):
+        models_by_app = _shop_models()
+        models_by_app['shop']['Owner'].fields['boss'] = _foreign_key(
+            OWNER, 'boss', OWNER)
+        self.assertTrue(self._cost(models_by_app, 'Item').cyclic)
+        self.assertTrue(self._cost(models_by_app, 'Owner').cyclic)
+
+    def test_non_local_related_model(self):
+        models_by_app = _shop_models()
+        models_by_app['shop']['Owner'].fields['user'] = _foreign_key(
+            OWNER, 'user', _model_info('auth', 'User'))
+        self.assertEqual(self._cost(models_by_app, 'Item'),
+                         factorize.FactoryCost(rows=3, depth=2, fan_out=1,
+                                               cyclic=False))
+
+    def test_costs_only_when_requested(self):
+        command = factorize.Command(stdout=_Stream())
+        options = {
+            'report': 'text', 'dump_file': None, 'dump_depth': None,
+            'dump_items': None, 'build_factories': False, 'costs': False,
+            'cost_threshold': 10, 'cost_comments': False, 'write': False,
+            'verify': False}
+        with mock.patch.object(factorize, 'get_models_by_app',
+                               return_value=_shop_models()), \
+                mock.patch.object(factorize, '_get_factory_costs') as costs:
+            command.handle(**options)
+            self.assertFalse(costs.called)
+            options['cost_comments'] = True
+            command.handle(**options)
+            self.assertTrue(costs.called)
+
+
+class TestManyToMany(unittest.TestCase):
+
+    def test_hook(self):
+        tag = _model_info('shop', 'Tag')
+        models_by_app = _shop_models()
+        models_by_app['shop']['Item'].fields['tags'] = FieldData(
+            model=ITEM, name='tags', field_type='ManyToManyField',
+            is_relation=True, is_many_to_many=True, related_model=tag,
+            related_name='items')
+        models_by_app['shop']['Tag'] = _model_data(tag, [])
+        values = factorize._get_suggested_values(models_by_app)
+        self.assertEqual(values['shop']['Item']['tags'],
+                         'factory.PostGeneration(_many_to_many("tags", '
+                         '"shop.test_factories.TagFactory", bulk=True))')
+        source = factorize._render_factories(
+            models_by_app, values)['shop/test_factories.py']
+        compile(source, 'test_factories.py', 'exec')
+        self.assertIn('if related._state.adding]', source)
+
+
+_SHOP_FACTORIES = '''\
+import factory
+
+
+def _many_to_many(name, factory_path, bulk):
+    return None
+
+
+class OwnerFactory(factory.Factory):
+    class Meta:
+        model = dict
+
+
+class ItemFactory(factory.Factory):
+    class Meta:
+        model = dict
+
+    owner = factory.SubFactory("shop.test_factories.OwnerFactory")
+    tags = factory.PostGeneration(_many_to_many(
+        "tags", "blog.test_factories.TagFactory", bulk=True))
+    other = factory.SubFactory(OwnerFactory)
+'''
+
+
+_BLOG_FACTORIES = '''\
+import factory
+
+
+class TagFactory(factory.Factory):
+    class Meta:
+        model = dict
+'''
+
+
+class TestVerify(unittest.TestCase):
+
+    def _verify(self, sources):
+        return factorize._verify_factories(sources, jobs=1)
+
+    def test_factory_references(self):
+        self.assertEqual(factorize._get_factory_references(_SHOP_FACTORIES), [
+            (17, 'shop.test_factories.OwnerFactory'),
+            (18, 'blog.test_factories.TagFactory'),
+        ])
+
+    def test_unresolved_reference(self):
+        errors = self._verify({
+            os.path.join('shop', 'test_factories.py'): _SHOP_FACTORIES,
+            os.path.join('blog', 'test_factories.py'): 'import factory\n'})
+        self.assertEqual(errors['blog.test_factories'], [])
+        self.assertEqual(len(errors['shop.test_factories']), 1)
+        self.assertIn(':18: cannot resolve "blog.test_factories.TagFactory"',
+                      errors['shop.test_factories'][0])
+
+    def test_resolved_references(self):
+        errors = self._verify({
+            os.path.join('shop', 'test_factories.py'): _SHOP_FACTORIES,
+            os.path.join('blog', 'test_factories.py'): _BLOG_FACTORIES})
+        self.assertEqual(errors, {'shop.test_factories': [],
+                                  'blog.test_factories': []})
+
+    def test_broken_module(self):
+        source = _SHOP_FACTORIES.replace('def _many_to_many', 'def _unused')
+        errors = self._verify({
+            os.path.join('shop', 'test_factories.py'): source,
+            os.path.join('blog', 'test_factories.py'): 'import factory\n'})
+        self.assertEqual(len(errors['shop.test_factories']), 1)
+        self.assertIn("NameError: name '_many_to_many' is not defined",
+                      errors['shop.test_factories'][0])
+
+    def test_no_inherited_future_flags(self):
+        # The command module __future__ imports must not leak into the
+        # generated modules
+        source = 'STRING_TYPE = type("")\n'
+        with mock.patch.dict(factorize._VERIFY_SOURCES, {
+                'shop.test_factories': ('shop/test_factories.py', source)}), \
+                mock.patch.dict(factorize._VERIFY_MODULES, clear=True), \
+                mock.patch.object(factorize, 'compile', create=True,
+                                  wraps=compile) as compile_mock:
+            module = factorize._load_verify_module('shop.test_factories')
+        self.assertIs(module.STRING_TYPE, str)
+        self.assertTrue(compile_mock.call_args[1]['dont_inherit'])
+
+
+class TestWriteAndVerify(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        for app in ('shop', 'blog'):
+            os.mkdir(app)
+        with open(os.path.join('shop', 'test_factories.py'), 'w') as old:
+            old.write('# edited by hand\n')
+        post = _model_info('blog', 'Post')
+        self.models_by_app = _shop_models()
+        self.models_by_app['blog']['Post'] = _model_data(post, [])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_verify_written_modules_only(self):
+        command = factorize.Command(stdout=_Stream(), stderr=_Stream())
+        with mock.patch.object(factorize, 'get_models_by_app',
+                               return_value=self.models_by_app), \
+                mock.patch.object(factorize, '_verify_factories',
+                                  return_value={}) as verify:
+            command.handle(
+                report='text', dump_file=None, dump_depth=None,
+                dump_items=None, build_factories=False, costs=False,
+                cost_threshold=10, cost_comments=False, write=True, jobs=1,
+                fsync=False, force=False, verify=True, verify_jobs=1)
+        blog_path = os.path.join('blog', 'test_factories.py')
+        self.assertEqual(list(verify.call_args[0][0]), [blog_path])
+        self.assertTrue(os.path.exists(blog_path))
+        with open(os.path.join('shop', 'test_factories.py')) as old:
+            self.assertEqual(old.read(), '# edited by hand\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
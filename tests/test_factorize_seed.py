@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=protected-access,invalid-name
+
+"""
+test_factorize_seed
+----------------------------------
+
+Tests for the `factorize_seed` management command.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from multiprocessing.pool import ThreadPool
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from django.core.management.base import CommandError
+
+from django_factorize.django_factorize import FieldData
+from django_factorize.management.commands import factorize_seed
+
+from tests.test_factorize import (ITEM, OWNER, _model_data, _models_by_app,
+                                  _shop_models, _Stream)
+
+
+def _model(name, rows=0, **fields):
+    model = mock.Mock(__name__=name)
+    model._default_manager.all.return_value.count.return_value = rows
+    model._default_manager.all.return_value.filter.return_value \
+        .count.return_value = rows // 2
+    model._meta.get_field.side_effect = fields.__getitem__
+    return model
+
+
+def _field(related_model, null=False, unique=False):
+    return mock.Mock(related_model=related_model, null=null, unique=unique)
+
+
+class TestSeedOrder(unittest.TestCase):
+
+    def test_related_models_first(self):
+        order = factorize_seed._get_seed_order(_shop_models())
+        self.assertEqual([model_data.info for model_data in order],
+                         [OWNER, ITEM])
+
+    def test_cycles_go_last(self):
+        models_by_app = _shop_models()
+        models_by_app['shop']['Owner'].fields['item'] = FieldData(
+            model=OWNER, name='item', field_type='ForeignKey',
+            is_relation=True, related_model=ITEM, related_name='owners')
+        with mock.patch.object(factorize_seed.logger, 'warning') as warning:
+            order = factorize_seed._get_seed_order(models_by_app)
+        self.assertEqual([model_data.info for model_data in order],
+                         [ITEM, OWNER])
+        self.assertTrue(warning.called)
+
+    def test_self_relations(self):
+        item = _model_data(ITEM, [
+            FieldData(model=ITEM, name='parent', field_type='ForeignKey',
+                      is_relation=True, related_model=ITEM,
+                      related_name='children'),
+        ])
+        order = factorize_seed._get_seed_order(_models_by_app(item))
+        self.assertEqual([model_data.info for model_data in order], [ITEM])
+
+
+class TestCheckRelations(unittest.TestCase):
+
+    def assertRefused(self, message, *args):
+        with self.assertRaises(CommandError) as context:
+            factorize_seed._check_relations(*args)
+        self.assertIn(message, str(context.exception))
+
+    def test_self_relation(self):
+        model = _model('Node')
+        model._meta.get_field.side_effect = {
+            'parent': _field(model)}.__getitem__
+        self.assertRefused('Node.parent', model, ['parent'], 10, set(), {})
+        model._meta.get_field.side_effect = {
+            'parent': _field(model, null=True)}.__getitem__
+        factorize_seed._check_relations(model, ['parent'], 10, set(), {})
+
+    def test_empty_related_table(self):
+        group = _model('Group')
+        model = _model('Item', group=_field(group))
+        self.assertRefused('needs 1 Group rows, 0 available',
+                           model, ['group'], 10, set(), {})
+        factorize_seed._check_relations(model, ['group'], 10, {group}, {})
+
+    def test_unique_relation(self):
+        owner = _model('Owner', rows=30)
+        model = _model('Profile', owner=_field(owner, unique=True))
+        factorize_seed._check_relations(model, ['owner'], 30, set(), {})
+        self.assertRefused('needs 30 Owner rows, 15 available',
+                           model, ['owner'], 30, set(), {'owner': 5})
+        owner._default_manager.all.return_value.filter.assert_called_with(
+            pk__gt=5)
+
+
+class _QuerySet(object):
+    '''Records the calls of :py:func:`factorize_seed._get_relation_values`.'''
+
+    def __init__(self, pks):
+        self.pks = pks
+        self.calls = []
+
+    def order_by(self, order):
+        self.calls.append(('order_by', order))
+        return self
+
+    def filter(self, **kwargs):
+        self.calls.append(('filter', kwargs))
+        return self
+
+    def values_list(self, *fields, **kwargs):
+        self.calls.append(('values_list', fields, kwargs))
+        return self
+
+    def __getitem__(self, index):
+        self.calls.append(('slice', index.start, index.stop))
+        return self.pks[index]
+
+
+class TestRelationValues(unittest.TestCase):
+
+    def setUp(self):
+        factorize_seed._PK_SAMPLES.clear()
+        self.owner = _model('Owner')
+        self.owner.side_effect = lambda pk: ('owner', pk)
+        self.field = _field(self.owner)
+        self.model = _model('Item', owner=self.field)
+
+    def tearDown(self):
+        factorize_seed._PK_SAMPLES.clear()
+
+    def _values(self, pks, after, start, size):
+        self.owner._default_manager = _QuerySet(pks)
+        return factorize_seed._get_relation_values(self.model, 'owner',
+                                                   after, start, size)
+
+    def test_unique(self):
+        self.field.unique = True
+        self.assertEqual(self._values(list(range(30)), 5, 20, 3),
+                         [('owner', 20), ('owner', 21), ('owner', 22)])
+        self.assertEqual(self.owner._default_manager.calls, [
+            ('order_by', 'pk'),
+            ('filter', {'pk__gt': 5}),
+            ('values_list', ('pk', ), {'flat': True}),
+            ('slice', 20, 23),
+        ])
+
+    def test_unique_without_enough_rows(self):
+        self.field.unique = True
+        self.assertEqual(self._values([7, 8], None, 0, 3),
+                         [('owner', 7), ('owner', 8), None])
+        self.assertNotIn('filter', [call[0] for call in
+                                    self.owner._default_manager.calls])
+
+    def test_sample(self):
+        values = self._values([3, 4], None, 0, 10)
+        self.assertEqual(len(values), 10)
+        self.assertTrue(set(values) <= {('owner', 3), ('owner', 4)})
+        self.assertEqual(self.owner._default_manager.calls, [
+            ('order_by', '?'),
+            ('values_list', ('pk', ), {'flat': True}),
+            ('slice', None, factorize_seed._PK_SAMPLE_SIZE),
+        ])
+        # The sample is taken once per process
+        self.assertEqual(len(self._values([5], None, 0, 10)), 10)
+        self.assertEqual(self.owner._default_manager.calls, [])
+
+    def test_empty_sample(self):
+        self.assertEqual(self._values([], None, 0, 2), [None, None])
+
+    def test_self_relation(self):
+        self.field.related_model = self.model
+        self.assertEqual(self._values([1], None, 0, 3), [None, None, None])
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        checkpoint = factorize_seed._Checkpoint.load(self.path, 100, 10)
+        checkpoint.after['shop.Item'] = {'owner': 5}
+        checkpoint.mark_done('shop.Item', 3)
+        checkpoint.mark_done('shop.Item', 1)
+        loaded = factorize_seed._Checkpoint.load(self.path, 100, 10)
+        self.assertEqual(loaded.done, {'shop.Item': {1, 3}})
+        self.assertEqual(loaded.after, {'shop.Item': {'owner': 5}})
+
+    def test_other_sizes(self):
+        factorize_seed._Checkpoint.load(self.path, 100, 10).mark_done(
+            'shop.Item', 0)
+        with self.assertRaises(CommandError):
+            factorize_seed._Checkpoint.load(self.path, 100, 20)
+
+
+class TestSeed(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'checkpoint.json')
+        self.lock = threading.Lock()
+        self.inserted = []
+        self.fail = True
+        factory = mock.Mock()
+        patches = [
+            mock.patch.object(factorize_seed, 'get_models_by_app',
+                              return_value=_shop_models()),
+            mock.patch.object(factorize_seed.Command, '_get_factory',
+                              return_value=factory),
+            mock.patch.object(factorize_seed, '_get_last_related_pks',
+                              return_value={}),
+            mock.patch.object(factorize_seed, '_check_relations'),
+            mock.patch.object(factorize_seed, '_close_connections'),
+            mock.patch.object(factorize_seed, '_init_worker',
+                              side_effect=factorize_seed._set_stop_event),
+            # Threads share the patches, worker processes would not
+            mock.patch.object(factorize_seed.multiprocessing, 'Pool',
+                              ThreadPool),
+            mock.patch.object(factorize_seed, '_insert_chunk',
+                              side_effect=self._insert),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        factorize_seed._set_stop_event(None)
+        shutil.rmtree(self.directory)
+
+    def _insert(self, task):
+        if self.fail and task.label == 'shop.Item' and task.chunk == 0:
+            raise ValueError('chunk 0 failed')
+        with self.lock:
+            self.inserted.append((task.label, task.chunk))
+
+    def _seed(self, workers):
+        command = factorize_seed.Command(stdout=_Stream(), stderr=_Stream())
+        command.handle(rows=100, chunk_size=10, workers=workers,
+                       checkpoint=self.checkpoint)
+        return command
+
+    def _recorded(self):
+        with open(self.checkpoint) as checkpoint_file:
+            done = json.load(checkpoint_file)['done']
+        return {(label, chunk) for label, chunks in done.items()
+                for chunk in chunks}
+
+    def _check_failure_and_resume(self, workers):
+        with self.assertRaises(CommandError) as context:
+            self._seed(workers)
+        self.assertIn('shop.Item: 1 chunks failed', str(context.exception))
+        # Every inserted chunk is recorded, and only those
+        self.assertEqual(self._recorded(), set(self.inserted))
+        self.assertNotIn(('shop.Item', 0), self._recorded())
+
+        first_run = list(self.inserted)
+        self.fail = False
+        self._seed(workers)
+        resumed = self.inserted[len(first_run):]
+        self.assertEqual(sorted(first_run + resumed),
+                         sorted((label, chunk)
+                                for label in ('shop.Owner', 'shop.Item')
+                                for chunk in range(10)))
+
+    def test_failed_chunk_and_resume(self):
+        self._check_failure_and_resume(workers=1)
+        self.assertEqual(self.inserted[10:],
+                         [('shop.Item', chunk) for chunk in range(10)])
+
+    def test_failed_chunk_and_resume_in_pool(self):
+        self._check_failure_and_resume(workers=3)
+
+
+if __name__ == '__main__':
+    unittest.main()